@@ -1,12 +1,27 @@
-import time
-import threading
-from dataclasses import dataclass
-from lib.terminal_graphics import Terminal, ScreenData, Coords
+import sys
+from typing import TYPE_CHECKING
+from lib.terminal_graphics import (
+    Terminal, ScreenData, Framebuffer, FramePresenter, PresenterThread, NonBlockingStream, NullStream, Coords,
+)
 from lib.sprites import Sprites
 from lib.parameters import MagicNumbers
-import keyboard
+from lib.spatial import SpatialHash
+from lib.scheduler import FixedTimestepLoop, PhaseTimer, AdaptiveRenderRate
+from lib.input_events import open_input
+from lib.camera import Camera
+from lib import level_format, entity_store
+from lib.entity_store import EntityStore
+from lib.snapshot import Snapshot, Snapshotter
+from lib.navigation import NavigationGrid
+from lib.level_format import LevelData, TileLayer, LevelFormatError
+
+if TYPE_CHECKING:
+    from lib.profiler import Profiler # Imported by main, only when profiling
 
 class Ground():
+    layer = 'ground' # The collision index layer the ground tiles go in
+    tiles: TileLayer = None # A ground strip has no tile layer, its tiles get inserted in the collision index
+
     def __init__(self, screen: ScreenData, width: int, pos: Coords):
         super().__init__() # I don't know why this is here, but it's behavior looks good to me
         self.width = width
@@ -24,16 +39,14 @@ class Ground():
         
         Returns:
             None"""
-        # Place a ground block in each coordinate, reads as the following:
-        # For each number in the range of the width:                        <--+
-        #   Place a ground block in coordnates:                                | number
-        #       X = Ground's root x position + the number from the for loop ---+
-        for number in range(self.width):
-            Terminal.place_sprite(
-                self.screen,
-                Sprites.GROUND_SPRITE,
-                Coords(xpos + number, ypos)
-            )
+        # Place a ground block in each coordinate, from the ground's root x position
+        # up to the root x position + the width, as one run of sprites
+        Terminal.place_sprite_run(
+            self.screen,
+            Sprites.GROUND_SPRITE,
+            Coords(xpos, ypos),
+            self.width
+        )
     
     def get_collision_coords(self):
         """
@@ -61,9 +74,44 @@ class Ground():
         
         return self.screen, collision_coords
 
+    def draw_view(self, camera: Camera):
+        # The whole strip is one clipped fill, whatever the camera is looking at
+        self.place_ground(self.xpos, self.ypos)
+
+class Terrain():
+    """Ground of any shape, read from the tile layer of a level file. The collision
+    index looks its tiles up in the layer, there is no object per tile."""
+    layer = 'ground'
+
+    def __init__(self, screen: ScreenData, tiles: TileLayer):
+        self.screen = screen
+        self.tiles = tiles
+        self.pos = Coords(0, 0)
+        self.xpos = 0
+        self.ypos = 0
+        self.width = tiles.width
+
+    def draw_view(self, camera: Camera):
+        """Place the ground tiles the camera can see, one run of sprites at a time.
+
+        Args:
+            camera (Camera): The camera looking at the terrain.
+
+        Returns:
+            None"""
+        for ypos in range(self.tiles.height):
+            for xpos, count in self.tiles.runs(ypos, camera.xpos, camera.xpos + camera.width, level_format.TILE_GROUND):
+                Terminal.place_sprite_run(self.screen, Sprites.GROUND_SPRITE, Coords(xpos, ypos), count)
+
 # Please note that refactoring the other classes to inherit from another thing may be
 # bad for the program length, despite doing the exact same thing.
 class Coin(): # Also known as the Mother of All Objects
+    layer = 'coin' # The collision index layer the object goes in
+    index: SpatialHash = None # Set by the collision index once the object is inserted in it
+    snapshot_key: int = None # Set by the world, the object's key in world snapshots
+    background: 'Background' = None # Set by the world when the object is drawn in a cached background
+    navigation: NavigationGrid = None # Set by the world when enemies have to find their way around the object
+
     def __init__(self, screen: ScreenData, pos: Coords):
         # Initialize the position of the coin
         self.pos = pos
@@ -80,7 +128,21 @@ class Coin(): # Also known as the Mother of All Objects
         # Initialize a flag to indicate if the coin has been killed
         self.killed = False
 
-    def hide_coin(self): self.hide = True
+    def hide_coin(self):
+        self.hide = True
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        # The cached background the object is drawn in has to draw it again
+        if self.background is not None: self.background.dirty.add(self)
+
+    def save_state(self):
+        # Everything about the object that can change while playing, see World.snapshot
+        return (self.hide, self.broken, self.updated, self.killed)
+
+    def load_state(self, state: tuple):
+        self.hide, self.broken, self.updated, self.killed = state
+        self.mark_dirty()
     # R.I.P __del__() dunder method, didn't even get used in the 1st place
 
     def render(self, previous_pos: Coords = None):
@@ -92,6 +154,8 @@ class Coin(): # Also known as the Mother of All Objects
         return self.screen
 
 class Powerup(Coin):
+    layer = 'powerup'
+
     def render(self, previous_pos: Coords = None):
         # Determine the sprite to render based on the hide flag
         if self.hide: sprite_to_render = Sprites.HIT_POWERUP_BLOCK_SPRITE # Hide block has been hit
@@ -105,6 +169,8 @@ class Powerup(Coin):
         return self.screen
     
 class StompableEnemy(Coin):
+    layer = 'enemy'
+
     def __init__(self, screen: ScreenData, pos: Coords):
         # Call the __init__ method of the parent class (Coin)
         # Pass in the screen and position arguments
@@ -122,17 +188,34 @@ class StompableEnemy(Coin):
         # Store the previous position of the enemy
         self.previous_pos = pos
 
-    def move_towards_player(self, player_pos: Coords):
+    def move_towards_player(self, player_pos: Coords, navigation: NavigationGrid = None):
         if self.killed: return  # Do not move if the enemy is killed
 
-        new_xpos = self.calculate_new_xpos(player_pos) # Calculate the new position of the enemy
-        new_ypos = self.pos.ypos
+        # Follow the flow field to the player, enemies that are not standing on anything head straight for its column
+        new_pos = navigation.next_step(self.pos) if navigation is not None else None
+        if new_pos is None: new_pos = Coords(self.calculate_new_xpos(player_pos), self.pos.ypos)
 
         self.previous_pos = self.pos
-        self.pos = Coords(new_xpos, new_ypos)
+        if new_pos == self.pos: return # Staying put, nothing else changes
+        self.pos = new_pos
+        if self.index: self.index.move(self, self.previous_pos, self.pos) # Keep the collision index in sync
         self.sidepos = self.get_side_positions(self.pos)
-        self.secondary_pos = Coords(new_xpos, new_ypos - 1)
+        self.secondary_pos = Coords(new_pos.xpos, new_pos.ypos - 1)
     
+    def save_state(self):
+        return (self.hide, self.broken, self.updated, self.killed, self.pos, self.previous_pos)
+
+    def load_state(self, state: tuple):
+        self.hide, self.broken, self.updated, self.killed, self.pos, self.previous_pos = state
+        self.sidepos = self.get_side_positions(self.pos)
+        self.secondary_pos = Coords(self.pos.xpos, self.pos.ypos - 1)
+
+    def kill(self):
+        self.killed = True
+        self.hide_coin()
+        # Dead enemies can't collide with anything anymore
+        if self.index: self.index.remove(self)
+
     def render(self):
         # Determine the sprite to render based on the hide/kill flags
         sprite_to_use = Sprites.ENEMY1_SPRITE if (not self.hide) or (not self.killed) else ' '
@@ -168,8 +251,62 @@ class StompableEnemy(Coin):
             new_xpos -= 1
         return new_xpos
     
+class StoredEnemy(StompableEnemy):
+    """A StompableEnemy whose position and killed flag live in an EntityStore, so every
+    enemy of the store can be moved in one batch. Gameplay code uses it like any enemy."""
+    def __init__(self, screen: ScreenData, pos: Coords, store: EntityStore):
+        self.store = store
+        store.add(self, pos.xpos, pos.ypos)
+        self.screen = screen
+        self.hide = False
+        self.broken = False
+        self.updated = False
+
+    @property
+    def pos(self):
+        return Coords(int(self.store.xpos[self.slot]), int(self.store.ypos[self.slot]))
+
+    @pos.setter
+    def pos(self, pos: Coords):
+        store, slot = self.store, self.slot
+        store.forget_cell(slot)
+        store.xpos[slot], store.ypos[slot] = pos.xpos, pos.ypos
+        if store.alive[slot]: store.cells.setdefault((pos.xpos, pos.ypos), []).append(self)
+
+    @property
+    def previous_pos(self):
+        return Coords(int(self.store.previous_xpos[self.slot]), int(self.store.ypos[self.slot]))
+
+    @property
+    def secondary_pos(self):
+        pos = self.pos
+        return Coords(pos.xpos, pos.ypos - 1)
+
+    @property
+    def sidepos(self):
+        return self.get_side_positions(self.pos)
+
+    @property
+    def killed(self):
+        return not self.store.alive[self.slot]
+
+    @killed.setter
+    def killed(self, killed: bool):
+        if killed: self.store.kill(self.slot)
+
+    def move_towards_player(self, player_pos: Coords, navigation: NavigationGrid = None):
+        # One enemy at a time, entity_store.follow moves the whole store at once
+        if self.killed: return
+        self.store.previous_xpos[self.slot] = self.store.xpos[self.slot]
+        step = navigation.next_step(self.pos) if navigation is not None else None
+        self.pos = step if step is not None else Coords(self.calculate_new_xpos(player_pos), self.pos.ypos)
+
 class Fireball(Coin):
-    def __init__(self, screen: ScreenData, pos: Coords, direction: int, enemies: tuple[StompableEnemy]):
+    layer = 'fireball'
+
+    slot: int = None # Set by the FireballPool, where the fireball is in its list of live fireballs
+
+    def __init__(self, screen: ScreenData, pos: Coords, direction: int):
         # Initialize the Fireball object with the necessary parameters
         super().__init__(screen, pos)
         # Store the direction of the fireball
@@ -178,8 +315,17 @@ class Fireball(Coin):
         self.hit = False
         # Initialize old position as None
         self.old_pos = None 
-        # Store the enemies that the fireball can collide with
-        self.enemies = enemies
+        # The fireball disappears once it gets past this x position
+        self.max_xpos = MagicNumbers.GROUND_WIDTH
+
+    def reset(self, pos: Coords, direction: int, max_xpos: int):
+        # Shoot a recycled fireball again, as if it was just made
+        self.pos = pos
+        self.secondary_pos = Coords(pos.xpos, pos.ypos - 1)
+        self.direction = direction
+        self.hide = self.broken = self.updated = self.killed = self.hit = False
+        self.old_pos = None
+        self.max_xpos = max_xpos
 
     def render(self, previous_pos: Coords = None):
         # Render the fireball on the screen at its current position
@@ -200,20 +346,10 @@ class Fireball(Coin):
         # If the fireball is at the edge of the screen, clear its position
         if self.pos.xpos == 0:
             Terminal.place_sprite(self.screen, ' ', self.pos)
-        if self.pos.xpos == (MagicNumbers.GROUND_WIDTH - 1):
+        if self.pos.xpos == (self.max_xpos - 1):
             Terminal.place_sprite(self.screen, ' ', self.pos)
 
-        # Check for collisions with enemies
-        for enemy in self.enemies:
-            for pos in enemy.sidepos:
-                if (pos == self.pos) and (not enemy.killed):
-                    self.hit = True
-                    enemy.killed = True
-                    Terminal.place_sprite(self.screen, ' ', enemy.pos)
-                    Terminal.place_sprite(self.screen, ' ', pos)
-        
-        new_screen = {Coords(5, 1): f'Last fireball position: {self.pos.xpos}, {self.pos.ypos}'}
-        self.screen.update(new_screen)
+        Terminal.place_text(self.screen, f'Last fireball position: {self.pos.xpos}, {self.pos.ypos}', Coords(5, 1))
         return self.screen
 
     def next_pos(self):
@@ -224,17 +360,148 @@ class Fireball(Coin):
         self.old_pos = self.pos
 
         self.pos = Coords(new_xpos, new_ypos)  # Create a new Coords instance with the updated position
+        if self.index: self.index.move(self, self.old_pos, self.pos)
         self.secondary_pos = Coords(new_xpos, new_ypos - 1)  # Update secondary position accordingly
 
         return self.ground_border_collision_check()
+
+    def save_state(self):
+        # Fireballs come and go, a world snapshot keeps their states and shoots them again when restored
+        return (self.pos, self.direction, self.hit, self.old_pos, self.max_xpos)
     
     def ground_border_collision_check(self):
-        if self.pos.xpos >= (MagicNumbers.GROUND_WIDTH) or self.pos.xpos < 0:
+        if self.pos.xpos >= (self.max_xpos) or self.pos.xpos < 0:
             self.screen[self.old_pos] = ' '  # Clear the character on the old position
             return True  # Indicate collision with ground border
         return False
 
+class StoredFireball(Fireball):
+    """A Fireball whose position lives in an EntityStore, so every fireball of the
+    store can be moved and checked for hits in one batch."""
+    def __init__(self, screen: ScreenData, pos: Coords, direction: int, store: EntityStore):
+        self.store = store
+        store.add(self, pos.xpos, pos.ypos, direction)
+        self.screen = screen
+        self.direction = direction
+        self.hide = False
+        self.broken = False
+        self.updated = False
+        self.killed = False
+        self.hit = False
+        self.old_pos = None
+        self.max_xpos = MagicNumbers.GROUND_WIDTH
+
+    @property
+    def pos(self):
+        return Coords(int(self.store.xpos[self.slot]), int(self.store.ypos[self.slot]))
+
+    @pos.setter
+    def pos(self, pos: Coords):
+        store, slot = self.store, self.slot
+        store.forget_cell(slot)
+        store.xpos[slot], store.ypos[slot] = pos.xpos, pos.ypos
+        if store.alive[slot]: store.cells.setdefault((pos.xpos, pos.ypos), []).append(self)
+
+    @property
+    def secondary_pos(self):
+        pos = self.pos
+        return Coords(pos.xpos, pos.ypos - 1)
+
+    @secondary_pos.setter
+    def secondary_pos(self, secondary_pos: Coords): pass # Always worked out from pos
+
+class FireballPool():
+    """The fireballs of a world, preallocated and recycled so shooting doesn't make
+    new objects. The live fireballs are packed in active, each one knowing its slot
+    in it, so despawning one moves the last fireball into its slot instead of
+    shifting the list. Despawned fireballs wait in a free list to be shot again.
+
+    update() moves every live fireball, then checks all of them for hits in one pass."""
+    def __init__(self, screen: ScreenData, index: SpatialHash, active: list[Fireball] = None, capacity: int = MagicNumbers.FIREBALL_POOL_SIZE):
+        self.screen = screen
+        self.index = index
+        self.active: list[Fireball] = active if active is not None else []
+        self.free: list[Fireball] = [Fireball(screen, Coords(0, 0), 1) for _ in range(capacity)]
+
+    def spawn(self, pos: Coords, direction: int, max_xpos: int):
+        """Shoot a fireball, a recycled one unless they are all flying.
+
+        Args:
+            pos (Coords): Where the fireball starts.
+            direction (int): The direction it flies in, -1 or 1.
+            max_xpos (int): The x position it disappears at.
+
+        Returns:
+            Fireball: The fireball."""
+        fireball = self.free.pop() if self.free else Fireball(self.screen, pos, direction)
+        fireball.reset(pos, direction, max_xpos)
+        fireball.slot = len(self.active)
+        self.active.append(fireball)
+        self.index.insert(fireball)
+        return fireball
+
+    def despawn(self, fireball: Fireball):
+        # Swap the last live fireball into the slot that frees up
+        last = self.active.pop()
+        if last is not fireball:
+            self.active[fireball.slot] = last
+            last.slot = fireball.slot
+        fireball.slot = None
+        self.index.remove(fireball)
+        self.free.append(fireball)
+
+    def clear(self):
+        while self.active: self.despawn(self.active[-1])
+
+    def update(self, player: 'Player', active_chunks: set[int] = None):
+        """Move every live fireball, then despawn the ones that left the ground or the
+        loaded chunks, and the ones that hit a coin or an enemy in, or right next to,
+        their cell.
+
+        Args:
+            player (Player): Gets the coins the fireballs collect.
+            active_chunks (set[int]): The loaded chunks, fireballs out of them can't hit anything anymore.
+
+        Returns:
+            None"""
+        active, index = self.active, self.index
+        for fireball in active:
+            if fireball.next_pos(): fireball.hit = True
+
+        # From the last slot down, so a despawn only ever swaps in a fireball that was already checked
+        for slot in range(len(active) - 1, -1, -1):
+            fireball = active[slot]
+            xpos, ypos = fireball.pos
+            if not fireball.hit and active_chunks is not None and xpos // MagicNumbers.CHUNK_WIDTH not in active_chunks:
+                fireball.hit = True
+            if not fireball.hit:
+                for coin in index.at('coin', xpos, ypos):
+                    if not coin.hide:
+                        coin.hide_coin()
+                        player.coins_collected += 1
+                        fireball.hit = True
+                        break
+            if not fireball.hit:
+                # The fireball's own cell first, then the ones on each side of it
+                for enemy_xpos in (xpos, xpos - 1, xpos + 1):
+                    for enemy in index.at('enemy', enemy_xpos, ypos):
+                        if not enemy.killed:
+                            enemy.kill()
+                            fireball.hit = True
+                            break
+                    if fireball.hit: break
+            if fireball.hit: self.despawn(fireball)
+
 class Brick(Coin):
+    layer = 'brick'
+
+    def break_brick(self):
+        self.hide_coin()
+        self.broken = True
+        # Broken bricks don't block anything, so they leave the collision index
+        if self.index: self.index.remove(self)
+        if self.navigation is not None: self.navigation.set_solid(self.pos, False)
+
     def render(self, previous_pos: Coords = None):
         """
         Render the brick on the screen at its current position.
@@ -261,23 +528,36 @@ class Player():
             fireballs: list[Fireball],
             bricks: tuple[Brick],
             enemies: tuple[StompableEnemy], 
+            coins: tuple[Coin] = (),
+            index: SpatialHash = None,
+            fireball_store: EntityStore = None,
+            fireball_pool: FireballPool = None,
         ):
         self.pos = pos
         self.velocity_y = 0
         self.screen = screen
         self.ground = ground
         self.grounded = False
-        self.ground_coords = ground.render()[1]
         self.powerups = powerups
         self.fireballs = fireballs
         self.bricks = bricks
         self.enemies = enemies  
         self.direction = Player.Right
 
-        self.power_coords, self.brick_coords, self.enemy_coords = [], [], [] 
-        for powerup in self.powerups: self.power_coords.append(powerup.pos)
-        for brick in self.bricks: self.brick_coords.append(brick.pos)
-        for enemy in self.enemies: self.enemy_coords.append(enemy.pos)  
+        # Collision index shared by the player and everything it can collide with,
+        # when one is given its owner (like a World streaming chunks in) fills it
+        if index is None:
+            index = SpatialHash()
+            for ground_pos in ground.render()[1]: index.insert(ground, ground_pos)
+            for powerup in self.powerups: index.insert(powerup)
+            for brick in self.bricks: index.insert(brick)
+            for enemy in self.enemies: index.insert(enemy)
+            for coin in coins: index.insert(coin)
+        self.index = index
+        # When there is a fireball store, the fireballs shot go in it and get moved in batches
+        self.fireball_store = fireball_store
+        # Otherwise they come out of a pool that keeps fireballs in the list of fireballs
+        self.fireball_pool = fireball_pool if fireball_pool is not None else FireballPool(screen, index, fireballs)
 
         self.coins_collected: int = 0
         self.powerstate = MagicNumbers.STARTING_POWERSTATE
@@ -286,6 +566,18 @@ class Player():
     class Left: pass
     class Right: pass
     class GameOverException(Exception): pass
+
+    def save_state(self):
+        return (
+            self.pos, self.velocity_y, self.grounded, self.direction,
+            self.coins_collected, self.powerstate, self.fire_cooldown,
+        )
+
+    def load_state(self, state: tuple):
+        (
+            self.pos, self.velocity_y, self.grounded, self.direction,
+            self.coins_collected, self.powerstate, self.fire_cooldown,
+        ) = state
     
     def apply_gravity(self):
         if not self.grounded:
@@ -308,61 +600,51 @@ class Player():
     def shoot(self):
         if (self.fire_cooldown == 0) and self.powerstate == 2:
             direction = 1 if self.direction == Player.Right else -1  
-            new_fireball = Fireball(self.screen, Coords(self.pos.xpos + direction, self.pos.ypos), direction, self.enemies)
-            self.fireballs.append(new_fireball)
-            self.fire_cooldown = 0
-    
-    def update_fireballs(self, coins: tuple[Coin]):
-        for fireball in self.fireballs[:]:  
-            collided = fireball.next_pos()
-            if collided:  
-                fireball.hit = True
-                self.fireballs.remove(fireball)  
+            fireball_pos = Coords(self.pos.xpos + direction, self.pos.ypos)
+            max_xpos = self.ground.xpos + self.ground.width
+            if self.fireball_store is not None:
+                new_fireball = StoredFireball(self.screen, fireball_pos, direction, self.fireball_store)
+                new_fireball.max_xpos = max_xpos
+                self.fireballs.append(new_fireball)
             else:
-                for coin in coins:
-                    if fireball.pos == coin.pos and not coin.hide:
-                        coin.hide_coin()
-                        self.coins_collected += 1
-                        self.fireballs.remove(fireball)  
-                        break  
-
-                for enemy in self.enemies:
-                    if fireball.pos == enemy.pos and not enemy.killed:
-                        enemy.killed = True
-                        self.screen[enemy.pos] = ' '
-                        self.screen[enemy.sidepos[0]] = ' '
-                        enemy.hide_coin()
-                        self.fireballs.remove(fireball)  
-                        break  
+                self.fireball_pool.spawn(fireball_pos, direction, max_xpos)
+            self.fire_cooldown = 0
     
+    def update_fireballs(self, coins: tuple[Coin] = ()):
+        # The coins are in the collision index, the pool finds them there
+        self.fireball_pool.update(self)
+
     def update_position(self):
         new_ypos = self.pos.ypos + self.velocity_y
 
-        ground_collision = Coords(self.pos.xpos, new_ypos) in self.ground_coords
-        powerup_collision = Coords(self.pos.xpos, new_ypos) in self.power_coords
-        brick_collision = Coords(self.pos.xpos, new_ypos) in self.brick_coords
+        # Everything the player would run into at its new position, straight from the collision index
+        hit_powerups = self.index.at('powerup', self.pos.xpos, new_ypos)
+        hit_bricks = self.index.at('brick', self.pos.xpos, new_ypos)
+        ground_collision = bool(self.index.at('ground', self.pos.xpos, new_ypos))
 
-        if powerup_collision:
-            for id, powcoord in enumerate(self.power_coords):
-                if powcoord == Coords(self.pos.xpos, new_ypos):
+        if hit_powerups:
+            for powerup in hit_powerups:
+                new_ypos = self.pos.ypos + 1
+                self.velocity_y = 0
+                if (not powerup.hide) and (self.powerstate < 2):
+                    self.powerstate += 1
+                powerup.hide_coin()
+        elif hit_bricks:
+            for brick in tuple(hit_bricks):
+                if not brick.broken:
                     new_ypos = self.pos.ypos + 1
                     self.velocity_y = 0
-                    if (not self.powerups[id].hide) and (self.powerstate < 2):
-                        self.powerstate += 1
-                    self.powerups[id].hide_coin()
-        elif brick_collision:
-            for id, brkcoord in enumerate(self.brick_coords):
-                if brkcoord == Coords(self.pos.xpos, new_ypos):
-                    if not self.bricks[id].broken:
-                        new_ypos = self.pos.ypos + 1
-                        self.velocity_y = 0
-                    if self.powerstate >= 1:
-                        self.bricks[id].hide_coin()
-                        self.bricks[id].broken = True
+                if self.powerstate >= 1:
+                    brick.break_brick()
         elif ground_collision:
-            new_ypos = self.ground.pos.ypos - 1
-            self.velocity_y = 0
-            self.grounded = True
+            if self.velocity_y < 0:
+                # Jumped into a tile above, like the bricks the player stays under it and starts falling
+                new_ypos = self.pos.ypos
+                self.velocity_y = 0
+            else:
+                new_ypos = new_ypos - 1 # Stand on top of the ground that got hit
+                self.velocity_y = 0
+                self.grounded = True
         
         else:
             self.grounded = False
@@ -380,45 +662,470 @@ class Player():
         elif self.powerstate == 1: sprite = Sprites.SUPER_PLAYER_SPRITE
         elif self.powerstate == 2: sprite = Sprites.FIREBALL_PLAYER_SPRITE
         else: sprite = 'P'
-        new_screen: ScreenData = {
-            self.pos: sprite,  
+        Terminal.place_sprite(self.screen, sprite, self.pos)
+        # The HUD stays in place while the camera scrolls
+        hud = {
             Coords(0, 0): str(self.coins_collected),
             Coords(0, 1): str(self.powerstate),
             Coords(0, 2): 'Left ' if self.direction == Player.Left else 'Right',
             Coords(5, 0): f"X Position: {self.pos.xpos}, Line: {self.pos.ypos}",
         }
-        self.screen.update(new_screen)
+        for pos, text in hud.items():
+            Terminal.place_text(self.screen, text, pos)
         return self.screen
     
     def coin_check(self, coins: tuple[Coin], powerups: tuple[Powerup]):
-        for coin in coins:
-            if (self.pos == coin.pos) and not coin.hide:
+        # The coins are looked up through the collision index, only the ones the player is touching get checked
+        for coin in self.index.at('coin', self.pos.xpos, self.pos.ypos):
+            if not coin.hide:
                 self.coins_collected += 1
                 coin.hide_coin()
-            else:
-                continue
     
     def enemy_check(self, enemies: tuple[StompableEnemy]):
-        for enemy in enemies:
-            if (self.pos == enemy.secondary_pos) and (not enemy.killed):
-                enemy.killed = True
-                enemy.hide_coin()
+        # Enemies right below the player get stomped
+        for enemy in tuple(self.index.at('enemy', self.pos.xpos, self.pos.ypos + 1)):
+            if not enemy.killed:
+                enemy.kill()
                 self.velocity_y = -3  
                 self.grounded = False  
 
-            if (self.pos == enemy.pos) and not enemy.killed:
+        # Enemies in the same cell as the player hurt it, once a tick however many of them piled up there,
+        # taking more than one hit at once would skip the powerstate right past game over
+        for enemy in tuple(self.index.at('enemy', self.pos.xpos, self.pos.ypos)):
+            if not enemy.killed:
                 if not self.powerstate == 0:
                     self.pos = Coords(self.pos.xpos - 4 if (self.direction == Player.Right) else 4, self.pos.ypos)
                 self.powerstate -= 1 if self.powerstate >= -1 else 0
                 self.screen.update({enemy.pos: Sprites.ENEMY1_SPRITE})
+                break
+
+class Chunk():
+    """A fixed-width vertical slice of the world and the objects that are in it."""
+    def __init__(self, number: int):
+        self.number = number
+        self.objects: list = [] # Coins, powerups and bricks, in render order
+        self.enemies: list[StompableEnemy] = [] # Enemies currently standing in the chunk
+
+class Background():
+    """The ground and the objects that only change when hit (coins, powerups and bricks)
+    of the loaded chunks, composited once into a framebuffer wider than the screen.
+    Frames start as a copy of the part the camera sees, instead of drawing the whole
+    level again. Objects mark themselves dirty when they change and only those get
+    drawn again, the whole thing is only recomposited when other chunks get loaded."""
+    def __init__(self, screen: Framebuffer, ground: Ground):
+        # Wide enough for every chunk that can be loaded at once
+        chunks = screen.width // MagicNumbers.CHUNK_WIDTH + 2 + 2 * MagicNumbers.CHUNK_MARGIN
+        self.buffer = Framebuffer(chunks * MagicNumbers.CHUNK_WIDTH, screen.height)
+        self.ground = ground
+        # The part of the world the buffer covers, what the ground gets drawn for
+        self.view = Camera(self.buffer.width, ground.xpos, ground.xpos + ground.width)
+        self.dirty: set = set() # Objects to draw again, see Coin.mark_dirty
+        self.stale = True # Whether it has to be recomposited, because other chunks got loaded
+
+    def adopt(self, obj):
+        # Make an object draw itself in the background rather than on the screen
+        obj.screen = self.buffer
+        obj.background = self
+
+    def rebuild(self, xpos: int, chunks: list[Chunk]):
+        """Composite the ground and the objects of the loaded chunks.
+
+        Args:
+            xpos (int): The world x position of the first loaded column.
+            chunks (List[Chunk]): The loaded chunks.
+
+        Returns:
+            None"""
+        self.buffer.clear()
+        self.buffer.origin_x = self.view.xpos = xpos
+        self.ground.draw_view(self.view)
+        for chunk in chunks:
+            for obj in chunk.objects:
+                obj.render()
+        self.dirty.clear()
+        self.stale = False
+
+    def draw(self, screen: Framebuffer, camera: Camera, xpos: int, chunks: list[Chunk]):
+        """Bring the background up to date and start a frame with the part of it the camera sees.
+
+        Args:
+            screen (Framebuffer): The frame to draw on.
+            camera (Camera): The camera.
+            xpos (int): The world x position of the first loaded column.
+            chunks (List[Chunk]): The loaded chunks.
+
+        Returns:
+            None"""
+        if self.stale:
+            self.rebuild(xpos, chunks)
+        elif self.dirty:
+            for obj in self.dirty: obj.render()
+            self.dirty.clear()
+        screen.copy_window(self.buffer, camera.xpos)
+
+class World():
+    """Everything a level is made of, stepped one tick at a time and rendered on demand.
+    This is what both the terminal game and the headless runner drive.
+
+    The world is split in chunks of MagicNumbers.CHUNK_WIDTH columns, only the chunks
+    around the camera are loaded in the collision index, simulated and rendered, so
+    the cost of a frame doesn't depend on how wide the level is.
+
+    With use_entity_store (needs numpy) enemies and fireballs live in EntityStores
+    and get moved, bounded and checked for hits in batches.
+
+    Enemies follow a single flow field to the player, worked out over the loaded
+    chunks whenever the player's cell or the terrain changes, see lib.navigation.
+
+    snapshot() captures the state of the world and restore() puts it back, see snapshot."""
+    def __init__(
+            self,
+            screen: ScreenData,
+            ground: Ground,
+            coins: tuple[Coin],
+            powerups: tuple[Powerup],
+            bricks: tuple[Brick],
+            enemies: tuple[StompableEnemy],
+            player_pos: Coords,
+            timer: PhaseTimer = None,
+            use_entity_store: bool = False,
+        ):
+        self.screen = screen
+        self.ground = ground
+        self.coins = coins
+        self.powerups = powerups
+        self.bricks = bricks
+        self.fireballs: list[Fireball] = []
+        self.index = SpatialHash()
+        # The live fireballs of the pool are the world's fireballs
+        self.fireball_pool = FireballPool(screen, self.index, self.fireballs)
+
+        self.enemy_store: EntityStore = None
+        self.fireball_store: EntityStore = None
+        if use_entity_store:
+            self.enemy_store = EntityStore(max(len(enemies), 1))
+            self.fireball_store = EntityStore()
+            enemies = tuple(StoredEnemy(screen, enemy.pos, self.enemy_store) for enemy in enemies)
+            # The store keeps track of where its enemies are, the index asks it
+            self.index.attach('enemy', self.enemy_store.at)
+        self.enemies = enemies
+        self.player = Player(
+            screen, player_pos, ground, powerups, self.fireballs, bricks, enemies, coins, self.index, self.fireball_store,
+            self.fireball_pool,
+        )
+        self.start_pos = player_pos
+        self.previous_pos = self.player.pos
+        self.timer = timer if timer is not None else PhaseTimer()
+        self.ticks = 0
+
+        # Sort every object in the chunk it starts in
+        self.chunks: dict[int, Chunk] = {}
+        for obj in coins + powerups + bricks:
+            self.chunk_at(obj.pos.xpos).objects.append(obj)
+        if self.enemy_store is None:
+            for enemy in enemies:
+                self.chunk_at(enemy.pos.xpos).enemies.append(enemy)
+
+        screen_width = getattr(screen, 'width', MagicNumbers.SCREEN_WIDTH)
+        self.camera = Camera(screen_width, ground.xpos, ground.xpos + ground.width)
+        # Terrain from a tile layer is looked up in it directly, so it never needs streaming
+        if ground.tiles is not None: self.index.attach_tiles('ground', ground.tiles, level_format.TILE_GROUND, ground)
+        # Ground, coins, powerups and bricks get drawn in a cached background, when drawing on a framebuffer
+        self.background: Background = None
+        if isinstance(screen, Framebuffer):
+            self.background = Background(screen, ground)
+            ground.screen = self.background.buffer
+            for obj in coins + powerups + bricks: self.background.adopt(obj)
+        # Enemies find their way to the player over the loaded chunks, see lib.navigation
+        self.navigation = NavigationGrid(getattr(screen, 'height', MagicNumbers.SCREEN_HEIGHT))
+        for brick in bricks: brick.navigation = self.navigation
+        self.active_chunks: set[int] = set()
+        self.chunk_range = range(0)
+        # Chunks whose objects might have changed since the last snapshot, all of them for the first one
+        self.touched_chunks: set[int] = set(self.chunks)
+        self.update_chunks()
+
+        # Objects with state of their own get a key in the world's snapshots, stored enemies are
+        # snapshotted through their store
+        self.objects = coins + powerups + bricks + (enemies if self.enemy_store is None else ())
+        for key, obj in enumerate(self.objects): obj.snapshot_key = key
+        self.snapshotter = Snapshotter()
+
+    def chunk_at(self, xpos: int):
+        number = xpos // MagicNumbers.CHUNK_WIDTH
+        chunk = self.chunks.get(number)
+        if chunk is None:
+            chunk = self.chunks[number] = Chunk(number)
+        return chunk
+
+    def update_chunks(self):
+        """Scroll the camera to the player, then load the chunks that came
+        into range and page out the ones that went out of it.
+
+        Returns:
+            None"""
+        self.camera.follow(self.player.pos)
+        chunk_range = self.camera.chunk_range(MagicNumbers.CHUNK_WIDTH, MagicNumbers.CHUNK_MARGIN)
+        if chunk_range == self.chunk_range: return # Most ticks the camera stays within the same chunks
+        self.chunk_range = chunk_range
+        wanted = set(chunk_range)
+        for number in self.active_chunks - wanted: self.unload_chunk(number)
+        for number in wanted - self.active_chunks: self.load_chunk(number)
+        self.active_chunks = wanted
+        self.touched_chunks.update(wanted)
+        if self.background is not None: self.background.stale = True
+        self.navigation.rebuild(*self.loaded_columns(), self.solid_cells())
+
+    def solid_cells(self):
+        # The cells of the loaded chunks enemies can't walk through: ground, powerups and unbroken bricks
+        start, end = self.loaded_columns()
+        ground = self.ground
+        if ground.tiles is not None:
+            for ypos in range(ground.tiles.height):
+                for xpos, length in ground.tiles.runs(ypos, start, end, level_format.TILE_GROUND):
+                    for xpos in range(xpos, xpos + length): yield xpos, ypos
+        else:
+            for xpos in range(max(start, ground.xpos), min(end, ground.xpos + ground.width)): yield xpos, ground.ypos
+        for chunk in self.loaded_chunks():
+            for obj in chunk.objects:
+                if obj.layer == 'powerup' or (obj.layer == 'brick' and not obj.broken): yield obj.pos
+
+    def ground_columns(self, number: int):
+        # The ground's columns that are in a chunk, for ground strips that get inserted in the collision index
+        if self.ground.tiles is not None: return range(0)
+        start = max(number * MagicNumbers.CHUNK_WIDTH, self.ground.xpos)
+        end = min((number + 1) * MagicNumbers.CHUNK_WIDTH, self.ground.xpos + self.ground.width)
+        return range(start, end)
+
+    def load_chunk(self, number: int):
+        for xpos in self.ground_columns(number):
+            self.index.insert(self.ground, Coords(xpos, self.ground.ypos))
+        chunk = self.chunks.get(number)
+        if chunk is None: return
+        for obj in chunk.objects:
+            if not obj.broken: self.index.insert(obj) # Broken bricks don't collide anymore
+        for enemy in chunk.enemies:
+            if not enemy.killed: self.index.insert(enemy)
+
+    def unload_chunk(self, number: int):
+        for xpos in self.ground_columns(number):
+            self.index.remove(self.ground, Coords(xpos, self.ground.ypos))
+        chunk = self.chunks.get(number)
+        if chunk is None: return
+        for obj in chunk.objects: self.index.remove(obj)
+        for enemy in chunk.enemies: self.index.remove(enemy)
+
+    def loaded_columns(self):
+        # The x positions covered by the loaded chunks, from start up to end
+        return self.chunk_range.start * MagicNumbers.CHUNK_WIDTH, self.chunk_range.stop * MagicNumbers.CHUNK_WIDTH
+
+    def loaded_chunks(self):
+        # The chunks in range that have objects in them
+        return [self.chunks[number] for number in sorted(self.active_chunks) if number in self.chunks]
+
+    def apply_action(self, action: str):
+        """Apply a player action, one of 'left', 'right', 'jump' or 'shoot'.
+
+        Args:
+            action (str): The action to apply.
+
+        Returns:
+            None"""
+        if action == 'left': self.player.move(-1)
+        elif action == 'right': self.player.move(1)
+        elif action == 'jump': self.player.jump()
+        elif action == 'shoot': self.player.shoot()
+        else: raise ValueError(f'Unknown action: {action}')
+
+    def tick(self):
+        player, timer = self.player, self.timer
+        with timer.phase('physics'):
+            player.coin_check(self.coins, self.powerups)
+            player.apply_gravity()
+            player.update_position()
+        with timer.phase('fireballs'):
+            if self.fireball_store is not None:
+                self.update_stored_fireballs()
+            else:
+                self.fireball_pool.update(player, self.active_chunks)
+        with timer.phase('enemies'):
+            player.enemy_check(self.enemies)
+            # One flow field to the player for all the enemies, worked out again only when the player's cell changed
+            self.navigation.update(player.pos)
+            if self.enemy_store is not None:
+                # Every enemy of the loaded chunks steps towards the player in one batch
+                start, end = self.loaded_columns()
+                entity_store.follow(self.enemy_store, self.navigation, player.pos.xpos, start, end)
+            else:
+                # Move the enemies of the loaded chunks towards the player
+                for chunk in self.loaded_chunks():
+                    for enemy in tuple(chunk.enemies):
+                        enemy.move_towards_player(player.pos, self.navigation)
+                        self.track_enemy(chunk, enemy)
+        with timer.phase('streaming'):
+            self.update_chunks()
+        self.ticks += 1
+
+    def update_stored_fireballs(self):
+        """Move every fireball of the fireball store, then drop the ones that left
+        the loaded chunks or hit a coin or an enemy, all in batches.
+
+        Returns:
+            None"""
+        store = self.fireball_store
+        start, end = self.loaded_columns()
+        start = max(start, self.ground.xpos)
+        end = min(end, self.ground.xpos + self.ground.width)
+        gone = set(entity_store.advance(store, start, end).tolist())
+
+        # Coins get collected by the fireballs flying into them
+        for slot, (xpos, ypos) in enumerate(zip(store.xpos[:store.count].tolist(), store.ypos[:store.count].tolist())):
+            if slot in gone: continue
+            for coin in self.index.at('coin', xpos, ypos):
+                if not coin.hide:
+                    coin.hide_coin()
+                    self.player.coins_collected += 1
+                    store.kill(slot)
+                    gone.add(slot)
+                    break
+
+        stride = self.ground.xpos + self.ground.width + 2
+        hit_fireballs, hit_enemies = entity_store.hits(store, self.enemy_store, stride)
+        for slot in hit_enemies.tolist(): self.enemy_store.handles[slot].kill()
+        gone.update(hit_fireballs.tolist())
+
+        # Removing from the highest slot down keeps the lower slots where they are
+        for slot in sorted(gone, reverse=True): store.remove(slot)
+        self.fireballs[:] = store.handles[:store.count]
+
+    def render_stored_enemies(self):
+        # Straight from the store's arrays, only the living enemies the camera can see
+        store, camera = self.enemy_store, self.camera
+        xpos, ypos = store.xpos[:store.count], store.ypos[:store.count]
+        visible = store.alive[:store.count] & (xpos >= camera.xpos) & (xpos < camera.xpos + camera.width)
+        for enemy_xpos, enemy_ypos in zip(xpos[visible].tolist(), ypos[visible].tolist()):
+            Terminal.place_sprite(self.screen, Sprites.ENEMY1_SPRITE, Coords(enemy_xpos, enemy_ypos))
+
+    def track_enemy(self, chunk: Chunk, enemy: StompableEnemy):
+        # Move an enemy that walked out of its chunk into the chunk it walked into
+        new_chunk = self.chunk_at(enemy.pos.xpos)
+        if new_chunk is chunk: return
+        chunk.enemies.remove(enemy)
+        new_chunk.enemies.append(enemy)
+        self.touched_chunks.add(new_chunk.number)
+        # Enemies walking out of the loaded chunks get paged out with the chunk they are in now
+        if new_chunk.number not in self.active_chunks: self.index.remove(enemy)
+
+    def snapshot(self):
+        """Capture the state of the world, cheap enough to do on every tick.
+
+        Only the objects of the chunks that were loaded since the last snapshot can have
+        changed, so only those get compared and the snapshot keeps the ones that did,
+        as a delta against the last snapshot (see lib.snapshot). The player, fireballs
+        and entity stores are small and kept whole. The screen is not part of it, every
+        frame is drawn from scratch.
+
+        Returns:
+            Snapshot: The snapshot, to give to restore."""
+        chunks = [self.chunks[number] for number in self.touched_chunks if number in self.chunks]
+
+        def entries():
+            for chunk in chunks:
+                yield ('chunk', chunk.number), tuple(enemy.snapshot_key for enemy in chunk.enemies)
+                for obj in chunk.objects: yield obj.snapshot_key, obj.save_state()
+                for enemy in chunk.enemies: yield enemy.snapshot_key, enemy.save_state()
+
+        enemy_arrays = ()
+        if self.enemy_store is not None:
+            store = self.enemy_store
+            enemy_arrays = tuple(array[:store.count].copy() for array in (store.xpos, store.ypos, store.previous_xpos, store.alive))
+        whole = (
+            self.ticks, self.previous_pos, self.player.save_state(),
+            tuple(fireball.save_state() for fireball in self.fireballs), enemy_arrays,
+        )
+        snapshot = self.snapshotter.capture(self.ticks, entries(), whole)
+        self.touched_chunks = set(self.active_chunks)
+        return snapshot
+
+    def restore(self, snapshot: Snapshot):
+        """Put the world back in the state it had when a snapshot was taken. Snapshots
+        taken after it stay valid, the world can go back and forth between any of them.
+
+        Args:
+            snapshot (Snapshot): A snapshot taken by this world.
+
+        Returns:
+            None"""
+        # Page everything out while the collision index still has it where it is now
+        for number in self.active_chunks: self.unload_chunk(number)
+        if self.fireball_store is None: self.fireball_pool.clear()
+
+        states = Snapshotter.resolve(snapshot)
+        for obj in self.objects: obj.load_state(states[obj.snapshot_key])
+        for chunk in self.chunks.values():
+            chunk.enemies = [self.objects[key] for key in states.get(('chunk', chunk.number), ())]
+
+        self.ticks, self.previous_pos, player_state, fireball_states, enemy_arrays = snapshot.whole
+        self.player.load_state(player_state)
+        if self.enemy_store is not None:
+            store = self.enemy_store
+            for array, saved in zip((store.xpos, store.ypos, store.previous_xpos, store.alive), enemy_arrays):
+                array[:store.count] = saved
+            for handle, alive in zip(store.handles, store.alive[:store.count].tolist()): handle.hide = not alive
+            store.rebuild_cells()
+        if self.fireball_store is not None:
+            self.fireballs.clear()
+            self.fireball_store.clear()
+        for fireball_state in fireball_states: self.restore_fireball(fireball_state)
+
+        # The camera follows the restored player, which loads the chunks around it back
+        self.active_chunks = set()
+        self.chunk_range = range(0)
+        self.update_chunks()
+        self.touched_chunks = set(self.active_chunks)
+        self.snapshotter.rewind(snapshot, states)
+
+    def restore_fireball(self, state: tuple):
+        pos, direction, hit, old_pos, max_xpos = state
+        if self.fireball_store is not None:
+            fireball = StoredFireball(self.screen, pos, direction, self.fireball_store)
+            fireball.max_xpos = max_xpos
+            self.fireballs.append(fireball)
+        else:
+            fireball = self.fireball_pool.spawn(pos, direction, max_xpos)
+        fireball.hit, fireball.old_pos = hit, old_pos
+
+    def render(self):
+        # Render the objects of the loaded chunks, relative to the camera
+        with self.timer.phase('render'):
+            chunks = self.loaded_chunks()
+            if self.background is not None:
+                self.background.draw(self.screen, self.camera, self.loaded_columns()[0], chunks)
             else:
-                continue
+                self.screen.clear()
+                self.ground.draw_view(self.camera)
+                for chunk in chunks:
+                    for obj in chunk.objects:
+                        obj.render()
+            for chunk in chunks:
+                for enemy in chunk.enemies:
+                    enemy.render()
+            if self.enemy_store is not None: self.render_stored_enemies()
+            for fireball in self.fireballs:
+                fireball.render()
+            self.player.render(self.previous_pos)
+            self.previous_pos = self.player.pos
+        return self.screen
+
+def build_default_world(screen: ScreenData):
+    """Build the demo level.
 
-def main():
-    screen: ScreenData = {}
+    Args:
+        screen (ScreenData): The screen the level renders on.
 
+    Returns:
+        World: The demo level."""
     level_ground = Ground(screen, MagicNumbers.GROUND_WIDTH, Coords(0, 10))
-    screen.update(level_ground.render()[0])
 
     coins: tuple = (
         Coin(screen, Coords(10, 7)),
@@ -439,76 +1146,304 @@ def main():
     enemies = (
         StompableEnemy(screen, Coords(35, 9)),
     )
-    fireballs: list[Fireball] = []
+    return World(screen, level_ground, coins, powerups, bricks, enemies, Coords(10, 2))
 
-    player = Player(screen, Coords(10, 2), level_ground, powerups, fireballs, bricks, enemies)
-    previous_pos = player.pos
+def generate_world(screen: ScreenData, width: int, enemy_count: int, spacing: int = 7, use_entity_store: bool = False):
+    """Build a level of any width out of a repeating pattern, for benchmarks.
 
-    Terminal.clear()
-    Terminal.hide_cursor()
-    stop_thread = False
-
-    def input_thread():
-        DELAY = 0.025
-
-        nonlocal stop_thread
-        while not stop_thread:
-            if keyboard.is_pressed('a'):
-                player.move(-1)
-                time.sleep(DELAY)
-            if keyboard.is_pressed('d'):
-                player.move(1)
-                time.sleep(DELAY)
-            if keyboard.is_pressed('space'):
-                player.jump()
-                time.sleep(DELAY)
-            if keyboard.is_pressed('f'):
-                player.shoot()
-                time.sleep(DELAY)
-            if keyboard.is_pressed('q'):
-                stop_thread = True
-            time.sleep(0.05)
-
-    thread = threading.Thread(target=input_thread)
-    thread.start()
+    Args:
+        screen (ScreenData): The screen the level renders on.
+        width (int): The width of the level's ground.
+        enemy_count (int): How many enemies to spread over the level.
+        spacing (int): The distance between two coins, bricks are spaced twice as far apart.
+        use_entity_store (bool): Keep enemies and fireballs in entity stores, see World.
+
+    Returns:
+        World: The generated level."""
+    level_ground = Ground(screen, width, Coords(0, 10))
+    coins = tuple(Coin(screen, Coords(xpos, 7)) for xpos in range(5, width, spacing))
+    powerups = tuple(Powerup(screen, Coords(xpos, 6)) for xpos in range(spacing * 3, width, spacing * 6))
+    bricks = tuple(
+        Brick(screen, Coords(xpos, 6)) for xpos in range(spacing, width, spacing * 2)
+        if xpos % (spacing * 6) != spacing * 3 # Leave the powerup spots alone
+    )
+    enemy_spacing = max(width // max(enemy_count, 1), 1)
+    enemies = tuple(
+        StompableEnemy(screen, Coords((20 + number * enemy_spacing) % width, 9)) for number in range(enemy_count)
+    )
+    return World(screen, level_ground, coins, powerups, bricks, enemies, Coords(2, 2), use_entity_store=use_entity_store)
+
+def build_world_from_level(screen: ScreenData, level: LevelData):
+    """Build a world from a level, like one loaded with level_format.load_level.
+
+    Args:
+        screen (ScreenData): The screen the level renders on.
+        level (LevelData): The level.
+
+    Returns:
+        World: The level's world."""
+    kinds = {
+        level_format.ENTITY_COIN: [],
+        level_format.ENTITY_POWERUP: [],
+        level_format.ENTITY_BRICK: [],
+        level_format.ENTITY_ENEMY: [],
+    }
+    for kind, xpos, ypos in level.entities:
+        if kind not in kinds: raise LevelFormatError(f'Unknown entity kind {kind} at {xpos}, {ypos}')
+        kinds[kind].append(Coords(xpos, ypos))
+    return World(
+        screen,
+        Terrain(screen, level.tiles),
+        tuple(Coin(screen, pos) for pos in kinds[level_format.ENTITY_COIN]),
+        tuple(Powerup(screen, pos) for pos in kinds[level_format.ENTITY_POWERUP]),
+        tuple(Brick(screen, pos) for pos in kinds[level_format.ENTITY_BRICK]),
+        tuple(StompableEnemy(screen, pos) for pos in kinds[level_format.ENTITY_ENEMY]),
+        Coords(*level.player_pos),
+    )
+
+def world_to_level(world: World):
+    """Convert a world as it was built (state like broken bricks is not kept) to a
+    level, to save the levels defined in code as level files.
+
+    Args:
+        world (World): The world.
+
+    Returns:
+        LevelData: The level."""
+    height = getattr(world.screen, 'height', MagicNumbers.SCREEN_HEIGHT)
+    if world.ground.tiles is not None:
+        tiles = TileLayer(world.ground.width, height, bytearray(world.ground.tiles.tiles))
+    else:
+        tiles = TileLayer(world.ground.xpos + world.ground.width, height)
+        for xpos in range(world.ground.xpos, world.ground.xpos + world.ground.width):
+            tiles.tiles[world.ground.ypos * tiles.width + xpos] = level_format.TILE_GROUND
+    entities = (
+        [(level_format.ENTITY_COIN, coin.pos.xpos, coin.pos.ypos) for coin in world.coins]
+        + [(level_format.ENTITY_POWERUP, powerup.pos.xpos, powerup.pos.ypos) for powerup in world.powerups]
+        + [(level_format.ENTITY_BRICK, brick.pos.xpos, brick.pos.ypos) for brick in world.bricks]
+        + [(level_format.ENTITY_ENEMY, enemy.pos.xpos, enemy.pos.ypos) for enemy in world.enemies]
+    )
+    return LevelData(tiles.width, tiles.height, (world.start_pos.xpos, world.start_pos.ypos), tiles, entities)
+
+def run_headless(world: World, ticks: int, script=None, presenter: FramePresenter = None, render_every: int = 1):
+    """Step a world as fast as possible, without a terminal, keyboard or sleeps.
+
+    Args:
+        world (World): The world to step.
+        ticks (int): How many ticks to run for at most.
+        script (Callable[[int], Iterable[str]]): Gives the actions to apply on each tick.
+        presenter (FramePresenter): Gets the rendered frames, defaults to one that throws them away.
+        render_every (int): Render and present one frame every this many ticks, 0 to never render.
+
+    Returns:
+        int: The number of ticks that ran, less than ticks if the game ended."""
+    presenter = presenter if presenter is not None else FramePresenter(NullStream())
+    for tick in range(ticks):
+        if script is not None:
+            for action in script(tick):
+                world.apply_action(action)
+        try:
+            world.tick()
+        except Player.GameOverException:
+            return tick
+        if render_every and tick % render_every == 0:
+            world.render()
+            with world.timer.phase('present'):
+                presenter.present(world.screen)
+    return ticks
+
+def build_world(screen: ScreenData, level_path: str = None):
+    """Build the world of a level file, or the demo level when there is none.
+
+    Args:
+        screen (ScreenData): The screen the level renders on.
+        level_path (str): The level file.
+
+    Returns:
+        World: The level's world."""
+    if level_path: return build_world_from_level(screen, level_format.load_level(level_path))
+    return build_default_world(screen)
+
+def profile_entities(profiler: 'Profiler'):
+    # Every entity class's render and update methods get timed, under their own phase
+    for cls in (Coin, Powerup, Brick, StompableEnemy, Fireball):
+        profiler.instrument(cls, 'render', 'move_towards_player', 'next_pos')
+    profiler.instrument(Player, 'render', 'update_position', 'update_fireballs', 'coin_check', 'enemy_check')
+    profiler.instrument(FireballPool, 'update')
+
+def main(
+        timings_log: str = None, level_path: str = None, record_path: str = None,
+        trace_path: str = None, hud: bool = False, pipelined: bool = True, spectate: str = None,
+    ):
+    # Optional parts (profiler, replays, input backends, color detection) only get imported or set up
+    # once they are needed, the terminal's color mode gets detected by the presenter's first frame
+    screen = Framebuffer(MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT)
+    world = build_world(screen, level_path)
+    # Every tick's actions get recorded, so the session can be replayed exactly
+    recorder = None
+    if record_path:
+        from lib import replay
+        recorder = replay.Recorder(level_path or '')
+    # Simulation runs at a fixed tick rate, rendering at its own rate, each phase gets timed.
+    # When profiling, entity methods get timed too and the phases are traced
+    profiling = trace_path is not None or hud
+    if profiling:
+        from lib.profiler import Profiler
+        timer = Profiler()
+    else:
+        timer = PhaseTimer()
+    loop = FixedTimestepLoop(MagicNumbers.TICK_RATE, MagicNumbers.RENDER_RATE, timer=timer)
+    render_rate = AdaptiveRenderRate(loop)
+    world.timer = timer
+    # Set up in the try below, whatever got set up before something failed gets torn down
+    spectators = None
+    output = None
+    input_source = None
+    presenter_thread = None
+
+    def tick():
+        actions = []
+        with timer.phase('input'):
+            for event in input_source.queue.drain():
+                if event.action == 'quit':
+                    loop.stop()
+                    return
+                world.apply_action(event.action)
+                actions.append(event.action)
+        if recorder: recorder.record_tick(actions)
+        world.tick()
+
+    def render(alpha: float):
+        world.render()
+        if spectators:
+            with timer.phase('spectators'):
+                spectators.publish(screen)
+        if presenter_thread:
+            with timer.phase('handoff'):
+                presenter_thread.submit(screen)
+        else:
+            with timer.phase('present'):
+                Terminal.update_screen(screen)
+        rate = render_rate.update(Terminal.presenter.stats())
+        if profiling:
+            timer.sample_presenter(Terminal.presenter)
+            timer.count('render rate', rate)
 
     try:
-        while not stop_thread:
-            player.coin_check(coins, powerups)
-            player.apply_gravity()
-            player.update_position()
-            player.update_fireballs(coins)
-            player.enemy_check(enemies)
+        # Viewers can watch the session live, the frames get encoded once for all of them, see lib.spectator.
+        # Started before the terminal gets set up, so an address that can't be used fails right away
+        if spectate:
+            from lib.spectator import SpectatorServer
+            server = SpectatorServer(spectate)
+            server.start()
+            spectators = server
 
-            # Move enemies towards the player
-            for enemy in enemies:
-                enemy.move_towards_player(player.pos)
-
-            # Render all objects
-            screen.clear()
-            level_ground.render()
-            for coin in coins:
-                coin.render()
-            for powerup in powerups:
-                powerup.render()
-            for brick in bricks:
-                brick.render()
-            for enemy in enemies:
-                enemy.render()
-            for fireball in fireballs:
-                fireball.render()
-            player.render(previous_pos)
+        Terminal.clear()
+        Terminal.hide_cursor()
+        # Frames get written without ever blocking, what the terminal can't take yet waits in the stream,
+        # and the render rate goes down while it can't keep up, see AdaptiveRenderRate
+        output = NonBlockingStream()
+        Terminal.presenter.stream = output
+
+        # Keys get queued with a timestamp as they arrive and are applied at tick boundaries,
+        # so only the game loop ever touches the player
+        input_source = open_input()
+        input_source.start()
+
+        if profiling: profile_entities(timer)
+        if hud: Terminal.presenter.overlay = timer.draw_overlay
+        # Frames get written to the terminal by a thread of their own, so a slow terminal doesn't hold the simulation up
+        if pipelined:
+            presenter_thread = PresenterThread(Terminal.presenter, timer)
+            presenter_thread.start()
 
-            previous_pos = player.pos
-            Terminal.update_screen(screen)
-            time.sleep(0.1)
+        loop.run(tick, render)
     finally:
-        stop_thread = True
-        thread.join()
+        if presenter_thread: presenter_thread.stop()
+        if spectators: spectators.stop()
+        if output is not None:
+            # Whatever is still pending gets sent before anything else writes to the terminal
+            Terminal.presenter.stream = sys.stdout
+            output.close()
+        if input_source: input_source.stop()
+        if output is not None:
+            # However the game ended, quitting included, the terminal is left as it was found
+            Terminal.clear()
+            Terminal.show_cursor()
+            Terminal.move_cursor(0, 0)
+        if recorder: recorder.save(record_path)
+        if profiling:
+            timer.uninstrument()
+            Terminal.presenter.overlay = None
+        if trace_path: timer.dump_trace(trace_path)
+        if timings_log:
+            dropped_frames = presenter_thread.frames_dropped if presenter_thread else 0
+            output_stats = {**(output.stats() if output is not None else {}), **render_rate.stats()}
+            if spectators: output_stats.update({f'spectator {name}': value for name, value in spectators.stats().items()})
+            with open(timings_log, 'a') as log:
+                log.write(f"{loop.ticks} ticks, {loop.frames} frames, {loop.dropped_ticks} dropped ticks, "
+                          f"{loop.skipped_frames} skipped frames, {dropped_frames} dropped frames | "
+                          f"{', '.join(f'{name} {value:g}' for name, value in output_stats.items())} | {timer.format_report()}\n")
+
+def play_replay(replay_path: str, speed: float = 1, start_tick: int = 0, headless: bool = False):
+    """Play a recorded session back.
+
+    Args:
+        replay_path (str): The replay file.
+        speed (float): How many times faster than real time to play it.
+        start_tick (int): The tick to start from, the ticks before it get fast-forwarded.
+        headless (bool): Step through the whole replay as fast as possible without drawing anything.
+
+    Returns:
+        ReplayPlayer: The replay at its end, with the world, the last tick played and why it ended."""
+    from lib import replay
+    recording = replay.load(replay_path)
+    screen = Framebuffer(MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT)
+    player = replay.ReplayPlayer(recording, build_world(screen, recording.level), game_over=Player.GameOverException)
+    player.seek(start_tick)
+    if headless:
+        player.fast_forward(len(recording.ticks))
+        return player
+
+    Terminal.clear()
+    Terminal.hide_cursor()
+    loop = FixedTimestepLoop(MagicNumbers.TICK_RATE * speed, MagicNumbers.RENDER_RATE)
+
+    def tick():
+        if not player.step() or player.ending: loop.stop()
+
+    def render(alpha: float):
+        Terminal.update_screen(player.world.render())
+
+    loop.run(tick, render)
+    Terminal.show_cursor()
+    return player
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Terminal Platformer Engine')
+    parser.add_argument('level', nargs='?', help='level file to play, the demo level when left out')
+    parser.add_argument('--record', metavar='FILE', help='record the session to a replay file')
+    parser.add_argument('--replay', metavar='FILE', help='play a replay file back instead of playing')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed, as a multiple of real time')
+    parser.add_argument('--seek', type=int, default=0, metavar='TICK', help='tick to start the replay from')
+    parser.add_argument('--headless', action='store_true', help='run the replay as fast as possible without drawing')
+    parser.add_argument('--profile', metavar='TRACE_FILE', help='profile the session and write a Chrome trace to a file')
+    parser.add_argument('--hud', action='store_true', help='draw live timings on the bottom row')
+    parser.add_argument('--timings-log', metavar='FILE', help='append a per-phase timing report of the session to a file')
+    parser.add_argument('--serial-present', action='store_true', help='write frames from the game loop instead of a presenter thread')
+    parser.add_argument('--spectate', metavar='ADDRESS',
+                        help='stream the session to viewers on a Unix socket path or a localhost TCP port, '
+                             'watch it with python -m lib.spectator ADDRESS')
+    arguments = parser.parse_args()
     try:
-        main()
+        if arguments.replay:
+            replayed = play_replay(arguments.replay, arguments.speed, arguments.seek, arguments.headless)
+            ending = f" ({replayed.ending})" if replayed.ending else ''
+            print(f"Replay ended at tick {replayed.tick}{ending}, {replayed.world.player.coins_collected} coins collected")
+            exit()
+        main(level_path=arguments.level, record_path=arguments.record, trace_path=arguments.profile, hud=arguments.hud,
+             timings_log=arguments.timings_log, pipelined=not arguments.serial_present, spectate=arguments.spectate)
     except Player.GameOverException:
         Terminal.clear()
         Terminal.show_cursor()
@@ -0,0 +1,335 @@
+"""Many headless worlds stepped in parallel, for automated playtesting and agent training.
+
+The worlds are split between worker processes. Actions go to the workers through
+pipes, observations come back through shared memory: a tile grid of what is on
+each world's screen and a row of stats per world, written in place by the workers,
+so nothing gets pickled on the way back.
+
+    with BatchSimulator(64, 'level.tpel') as batch:
+        batch.run(1000, scripted_input)    # Scripted, the input never leaves the workers
+        batch.step([['right']] * 64)       # Driven by a policy, one list of actions per world
+        grids = numpy.asarray(batch.tiles) # (worlds, height, width), no copy
+
+It can be run to measure throughput:
+    python batch.py [worlds] [ticks] [workers]
+"""
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+from Engine import World, Player, Coin, Powerup, Brick, build_world
+from lib.terminal_graphics import Framebuffer
+from lib.parameters import MagicNumbers
+from lib import level_format
+
+# Tile codes of the observed grids
+TILE_EMPTY = 0
+TILE_GROUND = 1
+TILE_COIN = 2
+TILE_POWERUP = 3
+TILE_USED_POWERUP = 4
+TILE_BRICK = 5
+TILE_ENEMY = 6
+TILE_FIREBALL = 7
+TILE_PLAYER = 8
+
+# Columns of the stats rows, one int32 each
+STATS = ('ticks', 'xpos', 'ypos', 'coins', 'powerstate', 'done', 'episodes')
+
+class WorkerError(Exception): pass
+
+def new_world(level_path: str):
+    return build_world(Framebuffer(MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT), level_path or None)
+
+def object_tile(obj: Coin):
+    # Tile code of a coin, powerup or brick, TILE_EMPTY once it is gone
+    if isinstance(obj, Brick): return TILE_EMPTY if obj.broken else TILE_BRICK
+    if isinstance(obj, Powerup): return TILE_USED_POWERUP if obj.hide else TILE_POWERUP
+    return TILE_EMPTY if obj.hide else TILE_COIN
+
+def observe(world: World, grid, width: int, height: int):
+    """Write what is on a world's screen as a grid of tile codes, row after row.
+
+    Args:
+        world (World): The world to observe.
+        grid (memoryview): Where to write the grid, width * height bytes.
+        width (int): The width of the grid.
+        height (int): The height of the grid.
+
+    Returns:
+        None"""
+    left = world.camera.xpos
+    cells = bytearray(width * height)
+
+    def put(xpos: int, ypos: int, tile: int):
+        xpos -= left
+        if 0 <= xpos < width and 0 <= ypos < height: cells[ypos * width + xpos] = tile
+
+    ground = world.ground
+    if ground.tiles is not None:
+        for ypos in range(min(height, ground.tiles.height)):
+            for xpos, length in ground.tiles.runs(ypos, left, left + width, level_format.TILE_GROUND):
+                start = ypos * width + xpos - left
+                cells[start:start + length] = bytes((TILE_GROUND,)) * length
+    elif 0 <= ground.ypos < height:
+        start, end = max(ground.xpos, left), min(ground.xpos + ground.width, left + width)
+        if start < end:
+            row = ground.ypos * width - left
+            cells[row + start:row + end] = bytes((TILE_GROUND,)) * (end - start)
+
+    for chunk in world.loaded_chunks():
+        for obj in chunk.objects:
+            tile = object_tile(obj)
+            if tile: put(obj.pos.xpos, obj.pos.ypos, tile)
+        for enemy in chunk.enemies:
+            if not enemy.killed: put(enemy.pos.xpos, enemy.pos.ypos, TILE_ENEMY)
+    store = world.enemy_store
+    if store is not None:
+        for xpos, ypos, alive in zip(store.xpos[:store.count].tolist(), store.ypos[:store.count].tolist(),
+                                     store.alive[:store.count].tolist()):
+            if alive: put(xpos, ypos, TILE_ENEMY)
+    for fireball in world.fireballs:
+        put(fireball.pos.xpos, fireball.pos.ypos, TILE_FIREBALL)
+    put(world.player.pos.xpos, world.player.pos.ypos, TILE_PLAYER)
+    grid[:] = cells
+
+class Worker:
+    """The worlds of one worker process, stepped on the commands of the BatchSimulator."""
+    def __init__(self, level_path: str, first: int, count: int, tiles_name: str, stats_name: str):
+        self.level_path = level_path
+        self.first = first
+        self.worlds = [new_world(level_path) for _ in range(count)]
+        self.done = [False] * count
+        self.episodes = [0] * count
+        self.tiles_memory = shared_memory.SharedMemory(tiles_name)
+        self.stats_memory = shared_memory.SharedMemory(stats_name)
+
+    def step_world(self, number: int, actions):
+        # A world whose game ended starts over, the ended state was observed on the step before
+        if self.done[number]: self.reset_world(number)
+        world = self.worlds[number]
+        for action in actions: world.apply_action(action)
+        try:
+            world.tick()
+        except Player.GameOverException:
+            self.done[number] = True
+
+    def reset_world(self, number: int):
+        self.worlds[number] = new_world(self.level_path)
+        self.done[number] = False
+        self.episodes[number] += 1
+
+    def observe(self):
+        width, height = MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT
+        tiles, stats = self.tiles_memory.buf, self.stats_memory.buf.cast('i')
+        try:
+            for number, world in enumerate(self.worlds):
+                index = self.first + number
+                observe(world, tiles[index * width * height:(index + 1) * width * height], width, height)
+                player = world.player
+                row = index * len(STATS)
+                stats[row:row + len(STATS)] = array('i', (
+                    world.ticks, player.pos.xpos, player.pos.ypos, player.coins_collected,
+                    player.powerstate, self.done[number], self.episodes[number],
+                ))
+        finally:
+            stats.release() # The shared memory can't be closed while the view is around
+
+    def handle(self, command: str, argument):
+        if command == 'step':
+            for number, actions in enumerate(argument): self.step_world(number, actions)
+        elif command == 'run':
+            ticks, script = argument
+            for _ in range(ticks):
+                for number, world in enumerate(self.worlds): self.step_world(number, script(world.ticks))
+        elif command == 'reset':
+            for number in argument: self.reset_world(number)
+        else:
+            raise ValueError(f'Unknown command {command!r}')
+
+    def serve(self, connection):
+        # Every command is answered with None once the worlds are observed, or with the
+        # traceback of what went wrong, which the BatchSimulator raises as a WorkerError
+        command, argument = None, None
+        try:
+            while command != 'close':
+                try:
+                    if command is not None: self.handle(command, argument)
+                    self.observe()
+                except Exception:
+                    # This process keeps serving, so it can still be closed
+                    connection.send(('error', traceback.format_exc()))
+                else:
+                    connection.send(None)
+                command, argument = connection.recv()
+        finally:
+            self.tiles_memory.close()
+            self.stats_memory.close()
+
+def worker_main(connection, level_path: str, first: int, count: int, tiles_name: str, stats_name: str):
+    try:
+        worker = Worker(level_path, first, count, tiles_name, stats_name)
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+        return
+    worker.serve(connection)
+
+class BatchSimulator:
+    """count independent worlds of the same level, split between worker processes.
+
+    After every call the observations of all worlds are in tiles, a (count, height, width)
+    memoryview of tile codes, and stats, a (count, len(STATS)) memoryview of int32s.
+    Both are backed by shared memory and get overwritten by the next call.
+
+    A world whose game ended has done set in its stats, and starts over on the next step.
+
+    An exception in a worker is raised by the call that sent it the command, as a
+    WorkerError with the worker's traceback."""
+    CLOSE_TIMEOUT = 5 # Seconds a worker gets to exit on close before it gets terminated
+
+    def __init__(self, count: int, level_path: str = '', workers: int = None):
+        self.count = count
+        self.width, self.height = MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT
+        workers = max(1, min(workers or os.cpu_count() or 1, count))
+        self.tiles_memory = shared_memory.SharedMemory(create=True, size=count * self.width * self.height)
+        self.stats_memory = shared_memory.SharedMemory(create=True, size=count * len(STATS) * 4)
+        self.tiles = self.tiles_memory.buf.cast('B', (count, self.height, self.width))
+        self.stats = self.stats_memory.buf.cast('i', (count, len(STATS)))
+        self.closed = False
+
+        # Worker -> the range of worlds it steps
+        self.ranges: list[range] = []
+        self.connections = []
+        self.processes = []
+        try:
+            for number in range(workers):
+                worlds = range(count * number // workers, count * (number + 1) // workers)
+                connection, worker_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=worker_main, daemon=True,
+                    args=(worker_connection, level_path, worlds.start, len(worlds), self.tiles_memory.name, self.stats_memory.name),
+                )
+                process.start()
+                self.ranges.append(worlds)
+                self.connections.append(connection)
+                self.processes.append(process)
+            self.wait()
+        except BaseException:
+            # Nothing gets to call close on a simulator that failed to start
+            self.close()
+            raise
+
+    def send(self, connection, command: str, argument):
+        try:
+            connection.send((command, argument))
+        except OSError: # The worker is gone, wait reports it
+            pass
+
+    def wait(self):
+        # Every worker answers once its worlds are observed, all of them get heard so they stay in step
+        errors = []
+        for number, (connection, process) in enumerate(zip(self.connections, self.processes)):
+            try:
+                reply = connection.recv()
+            except (EOFError, OSError):
+                process.join(BatchSimulator.CLOSE_TIMEOUT)
+                errors.append(f'Worker {number} exited with code {process.exitcode}')
+                continue
+            if reply is not None: errors.append(f'Worker {number} failed:\n{reply[1]}')
+        if errors: raise WorkerError('\n'.join(errors))
+
+    def step(self, actions):
+        """Step every world one tick.
+
+        Args:
+            actions (Sequence[Iterable[str]]): The actions of each world for the tick.
+
+        Returns:
+            memoryview: The tile grids."""
+        if len(actions) != self.count:
+            raise ValueError(f'Got actions for {len(actions)} worlds, there are {self.count}')
+        for connection, worlds in zip(self.connections, self.ranges):
+            self.send(connection, 'step', [tuple(actions[number]) for number in worlds])
+        self.wait()
+        return self.tiles
+
+    def run(self, ticks: int, script):
+        """Step every world many ticks with scripted input, without coming back to this process in between.
+
+        Args:
+            ticks (int): How many ticks to run.
+            script (Callable[[int], Iterable[str]]): Gives the actions of a world's tick, from its tick count.
+                It gets sent to the workers, so it has to be a module-level function.
+
+        Returns:
+            memoryview: The tile grids after the last tick."""
+        for connection in self.connections: self.send(connection, 'run', (ticks, script))
+        self.wait()
+        return self.tiles
+
+    def reset(self, worlds=None):
+        """Start worlds over from the beginning of the level.
+
+        Args:
+            worlds (Iterable[int]): The worlds to reset, all of them by default.
+
+        Returns:
+            memoryview: The tile grids."""
+        worlds = set(range(self.count) if worlds is None else worlds)
+        for connection, owned in zip(self.connections, self.ranges):
+            self.send(connection, 'reset', [number - owned.start for number in owned if number in worlds])
+        self.wait()
+        return self.tiles
+
+    def stat(self, world: int, name: str):
+        return self.stats[world, STATS.index(name)]
+
+    def close(self):
+        """Stop the workers and free the shared memory, also when workers died or failed.
+
+        Returns:
+            None"""
+        if self.closed: return
+        self.closed = True
+        try:
+            for connection in self.connections: self.send(connection, 'close', None)
+            for process in self.processes:
+                process.join(BatchSimulator.CLOSE_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for connection in self.connections: connection.close()
+        finally:
+            # The views have to go before the shared memory can be closed
+            self.tiles.release()
+            self.stats.release()
+            for memory in (self.tiles_memory, self.stats_memory):
+                memory.unlink()
+                try:
+                    memory.close()
+                except BufferError: # Arrays made from the observations still use it, it goes away with them
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def scripted_input(tick: int):
+    # Walk right, jumping every so often
+    return ('right', 'jump') if tick % 12 == 0 else ('right',)
+
+def main(count: int = 64, ticks: int = 500, workers: int = None):
+    with BatchSimulator(count, workers=workers) as batch:
+        start = time.perf_counter()
+        batch.run(ticks, scripted_input)
+        elapsed = time.perf_counter() - start
+        print(f"{count} worlds, {len(batch.processes)} workers: {count * ticks / elapsed:.0f} world ticks/sec")
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:4]]
+    main(*arguments)
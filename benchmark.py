@@ -0,0 +1,270 @@
+import os
+import sys
+import time
+import statistics
+import subprocess
+from Engine import build_default_world, generate_world, run_headless
+from lib.terminal_graphics import Framebuffer, FramePresenter, NullStream, Coords
+from lib.parameters import MagicNumbers
+from lib import entity_store
+
+# Level name -> function building the level on a screen
+LEVELS = {
+    'small': build_default_world,
+    'large': lambda screen: generate_world(screen, 5000, enemy_count=20),
+    'entity-heavy': lambda screen: generate_world(screen, MagicNumbers.GROUND_WIDTH, enemy_count=300, spacing=2),
+    'bullet-hell': lambda screen: generate_world(screen, 400, enemy_count=800),
+}
+if entity_store.available():
+    # Same level, with enemies and fireballs in NumPy entity stores
+    LEVELS['bullet-hell-soa'] = lambda screen: generate_world(screen, 400, enemy_count=800, use_entity_store=True)
+
+def scripted_input(tick: int):
+    """Walk right, jumping and shooting every so often.
+
+    Args:
+        tick (int): The tick the input is for.
+
+    Returns:
+        List[str]: The actions of the tick."""
+    actions = ['right']
+    if tick % 4 == 0: actions.append('shoot')
+    if tick % 12 == 0: actions.append('jump')
+    return actions
+
+def new_world(level: str):
+    world = LEVELS[level](Framebuffer(MagicNumbers.SCREEN_WIDTH, MagicNumbers.SCREEN_HEIGHT))
+    # Fireballs are part of the workload, so every benchmark plays with the fire power-up
+    world.player.powerstate = 2
+    return world
+
+def run_level(level: str, ticks: int, render: bool):
+    """Run a level headlessly, restarting it whenever the game ends.
+
+    Args:
+        level (str): The name of the level.
+        ticks (int): How many ticks to run in total.
+        render (bool): Whether to render and present every tick.
+
+    Returns:
+        Tuple[float, World, FramePresenter]: The elapsed time, the last world and the presenter."""
+    presenter = FramePresenter(NullStream())
+    world = new_world(level)
+    timer = world.timer
+    remaining = ticks
+    start = time.perf_counter()
+    while remaining:
+        ran = run_headless(world, remaining, scripted_input, presenter, render_every=1 if render else 0)
+        remaining -= ran
+        if remaining:
+            # Game over, keep going on a fresh copy of the level with the same timings
+            remaining -= 1
+            world = new_world(level)
+            world.timer = timer
+    return time.perf_counter() - start, world, presenter
+
+def benchmark(level: str, ticks: int):
+    """Measure simulation throughput, render cost and output size of a level.
+
+    Args:
+        level (str): The name of the level.
+        ticks (int): How many ticks to run.
+
+    Returns:
+        Dict[str, float]: The measurements."""
+    sim_time, _, _ = run_level(level, ticks, render=False)
+    _, world, presenter = run_level(level, ticks, render=True)
+    timings = world.timer.report()
+    return {
+        'ticks/sec': ticks / sim_time,
+        'render ms': timings['render']['average'],
+        'present ms': timings['present']['average'],
+        'bytes/frame': presenter.bytes_written / ticks,
+        'cells/frame': presenter.cells_written / ticks,
+    }
+
+def main(ticks: int = 2000):
+    print(f"{'level':<14}{'ticks/sec':>12}{'render ms':>12}{'present ms':>12}{'bytes/frame':>13}{'cells/frame':>13}")
+    for level in LEVELS:
+        result = benchmark(level, ticks)
+        print(f"{level:<14}{result['ticks/sec']:>12.0f}{result['render ms']:>12.3f}{result['present ms']:>12.3f}"
+              f"{result['bytes/frame']:>13.0f}{result['cells/frame']:>13.1f}")
+
+def coords_costs(cls, count: int = 100_000, repeat: int = 5):
+    """Measure what a coordinate type costs on the hot paths, best of a few runs.
+
+    Args:
+        cls (type): The coordinate type, built from an x and a y position.
+        count (int): How many coordinates to use for each measurement.
+        repeat (int): How many times to run each measurement.
+
+    Returns:
+        Dict[str, float]: Nanoseconds per construction, hash, comparison and dict lookup, and bytes per instance."""
+    import timeit
+    import tracemalloc
+    positions = [(number % 997, number % 12) for number in range(count)]
+    instances = [cls(xpos, ypos) for xpos, ypos in positions]
+    copies = [cls(xpos, ypos) for xpos, ypos in positions]
+    table = dict.fromkeys(instances)
+
+    def best(statement):
+        return min(timeit.repeat(statement, number=1, repeat=repeat)) / count * 1e9
+
+    tracemalloc.start()
+    kept = [cls(xpos, ypos) for xpos, ypos in positions]
+    size = tracemalloc.get_traced_memory()[0] / count
+    tracemalloc.stop()
+    del kept
+    return {
+        'new ns': best(lambda: [cls(xpos, ypos) for xpos, ypos in positions]),
+        'hash ns': best(lambda: [hash(pos) for pos in instances]),
+        'eq ns': best(lambda: [first == second for first, second in zip(instances, copies)]),
+        'lookup ns': best(lambda: [table[pos] for pos in copies]),
+        'bytes': size,
+    }
+
+def coords_per_tick(level: str, ticks: int = 500):
+    # How many Coords a level creates per tick, counted by wrapping the constructor for the run
+    created = 0
+    original = Coords.__new__
+
+    def counting_new(cls, *args, **kwargs):
+        nonlocal created
+        created += 1
+        return original(cls, *args, **kwargs)
+
+    world = new_world(level)
+    Coords.__new__ = counting_new
+    try:
+        ran = run_headless(world, ticks, scripted_input, render_every=1)
+    finally:
+        Coords.__new__ = original
+    return created / max(ran, 1)
+
+def coords_benchmark():
+    """Compare Coords against the frozen dataclass it used to be: cost per operation,
+    memory per instance, and the construction cost of a tick of each level.
+
+    Returns:
+        None"""
+    from dataclasses import dataclass
+
+    @dataclass(eq=True, frozen=True)
+    class DataclassCoords: # Coords as it was
+        xpos: int
+        ypos: int
+        attributes: tuple = None
+
+    results = {'dataclass': coords_costs(DataclassCoords), 'Coords': coords_costs(Coords)}
+    print(f"{'type':<12}{'new ns':>9}{'hash ns':>9}{'eq ns':>9}{'lookup ns':>11}{'bytes':>8}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['new ns']:>9.0f}{result['hash ns']:>9.0f}{result['eq ns']:>9.0f}"
+              f"{result['lookup ns']:>11.0f}{result['bytes']:>8.0f}")
+    print(f"{'level':<14}{'Coords/tick':>12}{'dataclass us/tick':>19}{'Coords us/tick':>16}")
+    for level in LEVELS:
+        per_tick = coords_per_tick(level)
+        print(f"{level:<14}{per_tick:>12.0f}{per_tick * results['dataclass']['new ns'] / 1000:>19.1f}"
+              f"{per_tick * results['Coords']['new ns'] / 1000:>16.1f}")
+
+# Where Engine.py is, startup gets measured from a fresh interpreter started there
+ENGINE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def import_time():
+    """Measure how long importing the engine takes, in a fresh interpreter.
+
+    Returns:
+        float: The import time, in milliseconds."""
+    code = 'import time; start = time.perf_counter(); import Engine; print(time.perf_counter() - start)'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ENGINE_DIRECTORY, capture_output=True, text=True, check=True)
+    return float(result.stdout) * 1000
+
+def resident_memory(pid: int):
+    # Resident set size of a process in megabytes, from /proc, None where there is no /proc
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def first_frame(arguments: list, timeout: float = 10):
+    """Launch the game in a pseudo-terminal, time how long it takes for its first
+    frame to show up and how much memory it uses by then, then quit it. Unix only.
+
+    Args:
+        arguments (List[str]): The interpreter arguments launching the game.
+        timeout (float): How long to wait for the first frame, in seconds.
+
+    Returns:
+        Tuple[float, float]: The time to first frame in milliseconds and the RSS in megabytes, None when unknown."""
+    import pty
+    import select
+    start = time.perf_counter()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.chdir(ENGINE_DIRECTORY)
+        os.execv(sys.executable, [sys.executable] + arguments)
+
+    output = b''
+    elapsed = rss = None
+    # The HUD is in every frame, so it showing up means the first frame is out
+    while b'Position:' not in output:
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready: break
+        try:
+            data = os.read(fd, 65536)
+        except OSError: # The game exited
+            break
+        if not data: break
+        output += data
+    else:
+        elapsed = (time.perf_counter() - start) * 1000
+        rss = resident_memory(pid)
+
+    # Quit the way a player would, then make sure it is gone
+    try:
+        os.write(fd, b'q')
+        deadline = time.perf_counter() + timeout
+        while not os.waitpid(pid, os.WNOHANG)[0]:
+            if time.perf_counter() > deadline:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                break
+            select.select([fd], [], [], 0.05)
+            try: os.read(fd, 65536)
+            except OSError: pass
+    finally:
+        os.close(fd)
+    return elapsed, rss
+
+def startup(runs: int = 5):
+    """Measure import time, time to first frame and memory at the first frame, for
+    both ways of launching the game. Running it with -m lets Python use the cached
+    bytecode of Engine.py, a script gets compiled every time.
+
+    Args:
+        runs (int): How many times to measure each, the medians get printed.
+
+    Returns:
+        None"""
+    imports = [import_time() for _ in range(runs)]
+    print(f"import Engine: {statistics.median(imports):.1f}ms")
+    print(f"{'launch':<22}{'first frame ms':>16}{'RSS MB':>10}")
+    for label, arguments in (('python Engine.py', ['Engine.py']), ('python -m Engine', ['-m', 'Engine'])):
+        frames = [first_frame(arguments) for _ in range(runs)]
+        times = [elapsed for elapsed, _ in frames if elapsed is not None]
+        memory = [rss for _, rss in frames if rss is not None]
+        if not times:
+            print(f"{label:<22}{'no frame':>16}")
+            continue
+        rss = f"{statistics.median(memory):.1f}" if memory else '?'
+        print(f"{label:<22}{statistics.median(times):>16.1f}{rss:>10}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'startup':
+        startup()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'coords':
+        coords_benchmark()
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,38 @@
+from lib.terminal_graphics import Coords
+
+class Camera:
+    """The part of the world that is on screen, scrolling horizontally to keep
+    the followed position centered without ever showing past the world's edges."""
+    def __init__(self, width: int, world_start: int, world_end: int):
+        self.width = width
+        self.world_start = world_start
+        self.world_end = world_end
+        self.xpos = world_start # World x position of the screen's left column
+
+    def follow(self, pos: Coords):
+        """Scroll so the given position is in the middle of the screen.
+
+        Args:
+            pos (Coords): The position to follow.
+
+        Returns:
+            bool: Whether the camera moved."""
+        xpos = pos.xpos - self.width // 2
+        # Stop at the world's end, and at its start for worlds narrower than the screen
+        xpos = max(self.world_start, min(xpos, self.world_end - self.width))
+        moved = xpos != self.xpos
+        self.xpos = xpos
+        return moved
+
+    def chunk_range(self, chunk_width: int, margin: int):
+        """Get the chunks that are on screen plus a margin of chunks on each side.
+
+        Args:
+            chunk_width (int): The width of a chunk.
+            margin (int): How many chunks to add on each side of the screen.
+
+        Returns:
+            range: The numbers of the chunks."""
+        first = self.xpos // chunk_width - margin
+        last = (self.xpos + self.width - 1) // chunk_width + margin
+        return range(first, last + 1)
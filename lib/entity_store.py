@@ -0,0 +1,216 @@
+from importlib.util import find_spec
+
+# The entity store is optional, everything works without it, one object at a time.
+# NumPy takes a while to import, so it only gets imported by the first store made
+numpy = None
+
+def available():
+    return numpy is not None or find_spec('numpy') is not None
+
+def load_numpy():
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+class EntityStore:
+    """Positions, directions and alive flags of many entities kept in contiguous
+    NumPy arrays (struct of arrays), so they can be updated in batches. Each slot
+    also keeps a handle, the object gameplay code uses to get at the entity."""
+    def __init__(self, capacity: int = 64):
+        try:
+            load_numpy()
+        except ImportError:
+            raise ImportError('EntityStore needs numpy') from None
+        self.count = 0
+        self.xpos = numpy.zeros(capacity, numpy.int64)
+        self.ypos = numpy.zeros(capacity, numpy.int64)
+        self.previous_xpos = numpy.zeros(capacity, numpy.int64)
+        self.direction = numpy.zeros(capacity, numpy.int64)
+        self.alive = numpy.zeros(capacity, bool)
+        self.handles: list = [None] * capacity
+        # (x, y) -> handles of the living entities in that cell, see rebuild_cells
+        self.cells: dict = {}
+
+    def grow(self):
+        capacity = len(self.xpos) * 2
+        for name in ('xpos', 'ypos', 'previous_xpos', 'direction', 'alive'):
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.handles.extend([None] * (capacity - len(self.handles)))
+
+    def add(self, handle, xpos: int, ypos: int, direction: int = 0):
+        """Add an entity at the end of the arrays.
+
+        Args:
+            handle: The object standing for the entity, gets a slot attribute.
+            xpos (int): The x position of the entity.
+            ypos (int): The y position of the entity.
+            direction (int): The direction the entity moves in, -1 or 1.
+
+        Returns:
+            int: The slot of the entity."""
+        if self.count == len(self.xpos): self.grow()
+        slot = self.count
+        self.xpos[slot] = self.previous_xpos[slot] = xpos
+        self.ypos[slot] = ypos
+        self.direction[slot] = direction
+        self.alive[slot] = True
+        self.handles[slot] = handle
+        handle.slot = slot
+        self.count += 1
+        self.cells.setdefault((xpos, ypos), []).append(handle)
+        return slot
+
+    def remove(self, slot: int):
+        """Remove an entity by moving the last one into its slot.
+
+        Args:
+            slot (int): The slot of the entity to remove.
+
+        Returns:
+            None"""
+        self.forget_cell(slot)
+        last = self.count - 1
+        if slot != last:
+            for array in (self.xpos, self.ypos, self.previous_xpos, self.direction, self.alive):
+                array[slot] = array[last]
+            moved = self.handles[last]
+            self.handles[slot] = moved
+            moved.slot = slot
+        self.handles[last] = None
+        self.count = last
+
+    def clear(self):
+        self.handles[:self.count] = [None] * self.count
+        self.count = 0
+        self.cells = {}
+
+    def kill(self, slot: int):
+        self.alive[slot] = False
+        self.forget_cell(slot)
+
+    def forget_cell(self, slot: int):
+        handle = self.handles[slot]
+        occupants = self.cells.get((int(self.xpos[slot]), int(self.ypos[slot])))
+        if occupants and handle in occupants: occupants.remove(handle)
+
+    def rebuild_cells(self):
+        """Rebuild the cell lookup after the arrays were updated in a batch.
+
+        Returns:
+            None"""
+        count = self.count
+        cells = {}
+        for handle, xpos, ypos, alive in zip(self.handles, self.xpos[:count].tolist(),
+                                              self.ypos[:count].tolist(), self.alive[:count].tolist()):
+            if alive: cells.setdefault((xpos, ypos), []).append(handle)
+        self.cells = cells
+
+    def at(self, xpos: int, ypos: int):
+        """Get the living entities in a cell, can be attached to a SpatialHash layer.
+
+        Args:
+            xpos (int): The x position of the cell.
+            ypos (int): The y position of the cell.
+
+        Returns:
+            List: The handles of the entities, empty if there are none."""
+        return self.cells.get((xpos, ypos), ())
+
+def follow(store: EntityStore, grid, target_xpos: int, start: int, end: int):
+    """Step every living entity with start <= x < end to the next cell of a flow field,
+    the ones the field has no step for step one column towards a target.
+
+    Args:
+        store (EntityStore): The entities.
+        grid (NavigationGrid): The flow field, see lib.navigation.
+        target_xpos (int): The x position to go towards without a step.
+        start (int): Entities before this x position stay put.
+        end (int): Entities from this x position on stay put.
+
+    Returns:
+        None"""
+    count = store.count
+    xpos, ypos = store.xpos[:count], store.ypos[:count]
+    store.previous_xpos[:count] = xpos
+    active = store.alive[:count] & (xpos >= start) & (xpos < end)
+
+    # Each entity's cell of the grid reads its step, all at once
+    columns = xpos - grid.start
+    inside = active & (columns >= 0) & (columns < grid.width) & (ypos >= 0) & (ypos < grid.height)
+    steps = numpy.full(count, -1, numpy.int64)
+    if grid.width: steps[inside] = numpy.frombuffer(grid.steps, numpy.int32)[(ypos * grid.width + columns)[inside]]
+    routed = steps >= 0
+    xpos[routed] = grid.start + steps[routed] % grid.width
+    ypos[routed] = steps[routed] // grid.width
+
+    unrouted = active & ~routed
+    xpos += numpy.sign(target_xpos - xpos) * unrouted
+    store.rebuild_cells()
+
+def advance(store: EntityStore, start: int, end: int):
+    """Move every entity one column in its direction, killing those that leave start <= x < end.
+
+    Args:
+        store (EntityStore): The entities.
+        start (int): The first x position entities can be at.
+        end (int): The x position entities can't reach.
+
+    Returns:
+        numpy.ndarray: The slots of the entities that left."""
+    count = store.count
+    xpos = store.xpos[:count]
+    store.previous_xpos[:count] = xpos
+    xpos += store.direction[:count] * store.alive[:count]
+    gone = store.alive[:count] & ((xpos < start) | (xpos >= end))
+    store.alive[:count] &= ~gone
+    store.rebuild_cells()
+    return numpy.flatnonzero(gone)
+
+def reach_of(cells):
+    # A row for each of the cells on the left, the cells themselves and the cells on the right
+    return numpy.stack((cells - 1, cells, cells + 1))
+
+def hits(projectiles: EntityStore, targets: EntityStore, stride: int):
+    """Find the target each living projectile hits, the first living target in its own
+    cell, or else in the cell on its left, or else on its right. Like the fireballs
+    of the object path, a projectile hits one target at most and gets used up by it,
+    going from the last projectile down.
+
+    Args:
+        projectiles (EntityStore): The projectiles.
+        targets (EntityStore): The targets.
+        stride (int): More than the largest x position plus one, used to pack cells in single integers.
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: The slots of the projectiles that hit and of the targets that got hit."""
+    projectile_count, target_count = projectiles.count, targets.count
+    empty = numpy.zeros(0, numpy.int64)
+    if not projectile_count or not target_count: return empty, empty
+
+    alive_projectiles = projectiles.alive[:projectile_count]
+    alive_targets = targets.alive[:target_count]
+    projectile_cells = projectiles.ypos[:projectile_count] * stride + projectiles.xpos[:projectile_count]
+    target_cells = targets.ypos[:target_count] * stride + targets.xpos[:target_count]
+    reached = reach_of(projectile_cells)
+
+    # Only the projectiles next to a living target, and the targets next to those, get paired one by one
+    candidates = numpy.flatnonzero(alive_projectiles & numpy.isin(reached, target_cells[alive_targets]).any(axis=0))
+    if not len(candidates): return empty, empty
+    near = numpy.flatnonzero(alive_targets & numpy.isin(target_cells, reached[:, candidates]))
+    # Cell -> the targets in it that are still there, by slot like EntityStore.at
+    occupants = {}
+    for slot, cell in zip(near.tolist(), target_cells[near].tolist()): occupants.setdefault(cell, []).append(slot)
+
+    hit_projectiles, hit_targets = [], []
+    for slot, cell in zip(reversed(candidates.tolist()), reversed(projectile_cells[candidates].tolist())):
+        for reached_cell in (cell, cell - 1, cell + 1):
+            remaining = occupants.get(reached_cell)
+            if remaining:
+                hit_projectiles.append(slot)
+                hit_targets.append(remaining.pop(0))
+                break
+    return numpy.array(hit_projectiles, numpy.int64), numpy.array(hit_targets, numpy.int64)
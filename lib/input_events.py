@@ -0,0 +1,151 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+from importlib.util import find_spec
+from typing import NamedTuple
+
+# Key -> action, the same bindings for every backend
+KEY_BINDINGS = {
+    'a': 'left',
+    'd': 'right',
+    ' ': 'jump',
+    'space': 'jump',
+    'f': 'shoot',
+    'q': 'quit',
+}
+
+class InputEvent(NamedTuple):
+    action: str
+    timestamp: float # time.perf_counter() of when the key was read
+
+class InputQueue:
+    """Hands input events from the backend's thread over to the simulation.
+    The simulation drains it at tick boundaries, so the player is only ever
+    touched by the thread running the game loop."""
+    def __init__(self):
+        self.events = deque() # append and popleft are atomic, no lock needed
+
+    def push(self, action: str, timestamp: float = None):
+        self.events.append(InputEvent(action, time.perf_counter() if timestamp is None else timestamp))
+
+    def drain(self):
+        """Take every event that arrived since the last drain, oldest first.
+
+        Returns:
+            List[InputEvent]: The events."""
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+class StdinInput:
+    """Reads keys straight from the terminal, with stdin switched to cbreak mode and
+    polled with select from a background thread. Needs no root or device access."""
+    POLL_TIMEOUT = 0.05 # How often the reader thread checks whether it should stop, in seconds
+    ESCAPE = '\033'
+
+    def __init__(self, queue: InputQueue = None, stream=None):
+        self.queue = queue if queue is not None else InputQueue()
+        self.stream = stream if stream is not None else sys.stdin
+        self.running = False
+        self.thread: threading.Thread = None
+        self.saved_attributes = None
+        # The start of an escape sequence a read cut off, finished by the next read
+        self.escape = ''
+
+    def start(self):
+        import termios
+        import tty
+        fd = self.stream.fileno()
+        self.saved_attributes = termios.tcgetattr(fd)
+        # Keys arrive one at a time without waiting for enter and without being echoed
+        tty.setcbreak(fd)
+        self.running = True
+        self.thread = threading.Thread(target=self.read_keys, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        import termios
+        self.running = False
+        if self.thread: self.thread.join()
+        if self.saved_attributes is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self.saved_attributes)
+            self.saved_attributes = None
+
+    def read_keys(self):
+        import select
+        fd = self.stream.fileno()
+        while self.running:
+            readable, _, _ = select.select([fd], [], [], StdinInput.POLL_TIMEOUT)
+            if not readable: continue
+            timestamp = time.perf_counter()
+            for key in self.keys(os.read(fd, 64).decode(errors='ignore')):
+                action = KEY_BINDINGS.get(key.lower())
+                if action: self.queue.push(action, timestamp)
+
+    def keys(self, text: str):
+        """Split what the terminal sent into single keys, leaving out the escape
+        sequences of keys like the arrows, whose last bytes ('A', 'D', ...) would
+        otherwise read as bound keys.
+
+        Args:
+            text (str): What got read.
+
+        Returns:
+            List[str]: The keys that aren't part of an escape sequence."""
+        keys = []
+        for character in text:
+            escape = self.escape
+            if not escape:
+                if character == StdinInput.ESCAPE: self.escape = character
+                else: keys.append(character)
+            elif escape == StdinInput.ESCAPE:
+                if character in '[O':
+                    self.escape += character # CSI or SS3, the sequence goes on
+                else:
+                    # The escape key on its own, or with Alt held, the key itself still counts
+                    self.escape = ''
+                    if character == StdinInput.ESCAPE: self.escape = character
+                    else: keys.append(character)
+            elif escape[1] == 'O' or '@' <= character <= '~':
+                self.escape = '' # The final byte, SS3 sequences only have one
+            else:
+                self.escape += character # Parameter and intermediate bytes of a CSI sequence
+        return keys
+
+class KeyboardHookInput:
+    """Gets key presses from the keyboard module's event hooks, for platforms
+    without termios. The keyboard module needs root on Linux."""
+    def __init__(self, queue: InputQueue = None):
+        self.queue = queue if queue is not None else InputQueue()
+        self.hook = None
+
+    def start(self):
+        import keyboard
+        self.hook = keyboard.on_press(self.on_press)
+
+    def stop(self):
+        import keyboard
+        if self.hook is not None:
+            keyboard.unhook(self.hook)
+            self.hook = None
+
+    def on_press(self, event):
+        action = KEY_BINDINGS.get(event.name)
+        if action: self.queue.push(action)
+
+def open_input(queue: InputQueue = None):
+    """Pick the input backend that works on this platform.
+
+    Args:
+        queue (InputQueue): The queue the backend pushes events in.
+
+    Returns:
+        StdinInput | KeyboardHookInput: The backend, not started yet."""
+    if find_spec('termios') is None: # Only there on unix-likes
+        return KeyboardHookInput(queue)
+    if not sys.stdin.isatty():
+        return KeyboardHookInput(queue)
+    return StdinInput(queue)
@@ -0,0 +1,211 @@
+"""Compact binary level files.
+
+A level file is a header, a tile layer with one byte per cell (row after row) for
+the static terrain, and an entity table with one record per object that has state
+(coins, powerups, bricks and enemies). Loading memory-maps the file, the tile layer
+is used straight from the mapping without any per-tile Python object.
+
+It can be run to convert a text level (see level_from_text) to a level file:
+    python -m lib.level_format level.txt level.tpel
+"""
+import mmap
+import os
+import struct
+import sys
+from typing import NamedTuple
+
+MAGIC = b'TPEL'
+VERSION = 1
+# Magic, version, width, height, player x, player y, entity count
+HEADER = struct.Struct('<4sHIHIHI')
+# Kind, x, y
+ENTITY = struct.Struct('<BIH')
+
+TILE_EMPTY = 0
+TILE_GROUND = 1
+
+ENTITY_COIN = 1
+ENTITY_POWERUP = 2
+ENTITY_BRICK = 3
+ENTITY_ENEMY = 4
+
+# Character of the text format -> tile or entity it stands for
+TEXT_TILES = {'#': TILE_GROUND}
+TEXT_ENTITIES = {'$': ENTITY_COIN, '?': ENTITY_POWERUP, 'B': ENTITY_BRICK, 'M': ENTITY_ENEMY}
+TEXT_PLAYER = 'P'
+
+class LevelFormatError(Exception): pass
+
+class TileLayer:
+    """A width x height grid of one byte tile codes, on top of any bytes-like
+    buffer (a bytearray, or a memoryview of a memory-mapped level file)."""
+    def __init__(self, width: int, height: int, tiles=None):
+        self.width = width
+        self.height = height
+        self.tiles = tiles if tiles is not None else bytearray(width * height)
+        if len(self.tiles) != width * height:
+            raise LevelFormatError(f'Tile layer is {len(self.tiles)} bytes, expected {width * height}')
+
+    def at(self, xpos: int, ypos: int):
+        """Get the tile code of a cell, cells outside of the layer are empty.
+
+        Args:
+            xpos (int): The x position of the cell.
+            ypos (int): The y position of the cell.
+
+        Returns:
+            int: The tile code."""
+        if 0 <= xpos < self.width and 0 <= ypos < self.height:
+            return self.tiles[ypos * self.width + xpos]
+        return TILE_EMPTY
+
+    def runs(self, ypos: int, start: int, end: int, code: int):
+        """Find the runs of a tile code on part of a row.
+
+        Args:
+            ypos (int): The row to look in.
+            start (int): The first column to look at.
+            end (int): The column to stop before.
+            code (int): The tile code to find.
+
+        Returns:
+            Iterator[Tuple[int, int]]: The x position and length of each run."""
+        start, end = max(start, 0), min(end, self.width)
+        row_start = ypos * self.width
+        run_start = None
+        for xpos in range(start, end):
+            if self.tiles[row_start + xpos] == code:
+                if run_start is None: run_start = xpos
+            elif run_start is not None:
+                yield run_start, xpos - run_start
+                run_start = None
+        if run_start is not None:
+            yield run_start, end - run_start
+
+class LevelData(NamedTuple):
+    width: int
+    height: int
+    player_pos: tuple # (x, y)
+    tiles: TileLayer
+    entities: list # [(kind, x, y)]
+
+def save_level(path: str, level: LevelData):
+    """Write a level file.
+
+    Args:
+        path (str): Where to write the file.
+        level (LevelData): The level to write.
+
+    Returns:
+        None"""
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, level.width, level.height,
+                               level.player_pos[0], level.player_pos[1], len(level.entities)))
+        file.write(bytes(level.tiles.tiles))
+        for kind, xpos, ypos in level.entities:
+            file.write(ENTITY.pack(kind, xpos, ypos))
+
+def load_level(path: str):
+    """Memory-map a level file, the tile layer stays backed by the mapping.
+
+    Args:
+        path (str): The level file.
+
+    Returns:
+        LevelData: The level."""
+    with open(path, 'rb') as file:
+        # An empty file can't be mapped at all, so the size gets checked first
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            raise LevelFormatError(f'{path} is too short to be a level file')
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, width, height, player_x, player_y, entity_count = HEADER.unpack_from(mapping)
+    if magic != MAGIC:
+        raise LevelFormatError(f'{path} is not a level file')
+    if version != VERSION:
+        raise LevelFormatError(f'{path} is a version {version} level file, only version {VERSION} is supported')
+
+    tiles_end = HEADER.size + width * height
+    if len(mapping) != tiles_end + entity_count * ENTITY.size:
+        raise LevelFormatError(f'{path} is truncated or has trailing data')
+    # The memoryview keeps the mapping alive for as long as the tile layer is around
+    tiles = TileLayer(width, height, memoryview(mapping)[HEADER.size:tiles_end])
+    entities = list(ENTITY.iter_unpack(memoryview(mapping)[tiles_end:]))
+    return LevelData(width, height, (player_x, player_y), tiles, entities)
+
+def level_from_text(text: str):
+    """Convert a text level, drawn with one character per cell: '#' for ground,
+    '$' for coins, '?' for powerups, 'B' for bricks, 'M' for enemies and 'P'
+    for where the player starts. Anything else is empty space.
+
+    Args:
+        text (str): The text level.
+
+    Returns:
+        LevelData: The level."""
+    lines = text.splitlines()
+    width = max((len(line) for line in lines), default=0)
+    tiles = TileLayer(width, len(lines))
+    entities = []
+    player_pos = (0, 0)
+    for ypos, line in enumerate(lines):
+        for xpos, character in enumerate(line):
+            if character in TEXT_TILES:
+                tiles.tiles[ypos * width + xpos] = TEXT_TILES[character]
+            elif character in TEXT_ENTITIES:
+                entities.append((TEXT_ENTITIES[character], xpos, ypos))
+            elif character == TEXT_PLAYER:
+                player_pos = (xpos, ypos)
+    return LevelData(width, len(lines), player_pos, tiles, entities)
+
+def level_to_text(level: LevelData):
+    """Convert a level back to the text format.
+
+    Args:
+        level (LevelData): The level.
+
+    Returns:
+        str: The text level."""
+    tile_characters = {code: character for character, code in TEXT_TILES.items()}
+    entity_characters = {kind: character for character, kind in TEXT_ENTITIES.items()}
+    rows = [
+        [tile_characters.get(level.tiles.at(xpos, ypos), ' ') for xpos in range(level.width)]
+        for ypos in range(level.height)
+    ]
+    for kind, xpos, ypos in level.entities:
+        rows[ypos][xpos] = entity_characters[kind]
+    rows[level.player_pos[1]][level.player_pos[0]] = TEXT_PLAYER
+    return '\n'.join(''.join(row) for row in rows)
+
+def same_level(first: LevelData, second: LevelData):
+    """Check whether two levels hold the same tiles, entities and player position.
+
+    Returns:
+        bool: Whether they are the same."""
+    return (
+        (first.width, first.height, tuple(first.player_pos)) == (second.width, second.height, tuple(second.player_pos))
+        and bytes(first.tiles.tiles) == bytes(second.tiles.tiles)
+        and sorted(first.entities) == sorted(second.entities)
+    )
+
+def convert(text_path: str, level_path: str):
+    """Convert a text level to a level file, making sure it loads back the same.
+
+    Args:
+        text_path (str): The text level.
+        level_path (str): Where to write the level file.
+
+    Returns:
+        LevelData: The converted level."""
+    with open(text_path) as file:
+        level = level_from_text(file.read())
+    save_level(level_path, level)
+    if not same_level(level, load_level(level_path)):
+        raise LevelFormatError(f'{level_path} did not load back the same as {text_path}')
+    return level
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python -m lib.level_format <text level> <level file>')
+        sys.exit(1)
+    converted = convert(sys.argv[1], sys.argv[2])
+    print(f'{sys.argv[2]}: {converted.width}x{converted.height}, {len(converted.entities)} entities')
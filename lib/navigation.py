@@ -0,0 +1,159 @@
+"""Flow fields that lead enemies to the player over the terrain.
+
+A NavigationGrid covers a window of columns, the loaded chunks of a world. It knows
+which of their cells are solid, and from that the cells an enemy can stand in and
+the moves between them: walking to the next column, stepping up onto a block one
+cell high and dropping off a ledge.
+
+Whenever the target or the terrain changes, one breadth-first search out from the
+target gives every standing cell the move that takes it closer. Standing cells with
+no way to the target get the move towards the target's column if there is one, and
+stay put otherwise. Enemies then read their next cell in O(1), so the search costs
+the same however many enemies follow it.
+"""
+from array import array
+from collections import deque
+from lib.terminal_graphics import Coords
+
+NO_STEP = -1 # Step of the cells that can't get any closer to the target
+
+class NavigationGrid:
+    """The solid cells of a window of columns and the flow field towards a target
+    over them. Cells are numbered row after row, from the window's first column."""
+    def __init__(self, height: int):
+        self.height = height
+        self.start = 0 # World x position of the window's first column
+        self.width = 0
+        self.solid = bytearray()
+        # Standing cell -> the cells it can move to on its left and on its right, None where it can't
+        self.moves: dict = {}
+        # Standing cell -> the standing cells that can move to it in one step
+        self.sources: dict = {}
+        # Cell -> the cell to move to next, NO_STEP if there is none
+        self.steps = array('i')
+        self.target: tuple = None # The standing cell the field leads to, or None, and the target's column
+        self.stale = True # Whether the moves changed since the field was worked out
+
+    def rebuild(self, start: int, end: int, solid_cells):
+        """Cover a new window of columns.
+
+        Args:
+            start (int): The first column of the window.
+            end (int): The column the window stops before.
+            solid_cells (Iterable[Tuple[int, int]]): The solid cells, the ones out of the window are left out.
+
+        Returns:
+            None"""
+        self.start, self.width = start, end - start
+        self.solid = bytearray(self.width * self.height)
+        for xpos, ypos in solid_cells:
+            xpos -= start
+            if 0 <= xpos < self.width and 0 <= ypos < self.height: self.solid[ypos * self.width + xpos] = 1
+        self.steps = array('i', [NO_STEP]) * len(self.solid)
+        self.link()
+
+    def set_solid(self, pos: Coords, solid: bool):
+        """Change a single cell, like a brick getting broken.
+
+        Args:
+            pos (Coords): The cell.
+            solid (bool): Whether it is solid now.
+
+        Returns:
+            None"""
+        xpos = pos.xpos - self.start
+        if 0 <= xpos < self.width and 0 <= pos.ypos < self.height:
+            self.solid[pos.ypos * self.width + xpos] = solid
+            self.link()
+
+    def free(self, xpos: int, ypos: int):
+        # Whether a cell of the window, by its column in the window, can be walked through
+        return 0 <= xpos < self.width and 0 <= ypos < self.height and not self.solid[ypos * self.width + xpos]
+
+    def landing(self, xpos: int, ypos: int):
+        """Find where something falling from a cell comes to stand.
+
+        Args:
+            xpos (int): The column of the cell, in the window.
+            ypos (int): The row of the cell.
+
+        Returns:
+            int: The standing cell, None if it falls out of the window or the cell is solid."""
+        if not self.free(xpos, ypos): return None
+        solid, width = self.solid, self.width
+        for ypos in range(ypos, self.height - 1):
+            if solid[(ypos + 1) * width + xpos]: return ypos * width + xpos
+        return None
+
+    def link(self):
+        # Work out the moves out of every standing cell, a free cell right on top of a solid one
+        solid, width = self.solid, self.width
+        moves, sources = {}, {}
+        for below in range(width, len(solid)):
+            if not solid[below] or solid[below - width]: continue
+            cell = below - width
+            xpos, ypos = cell % width, cell // width
+            destinations = []
+            for step in (-1, 1):
+                destination = None
+                if self.free(xpos + step, ypos):
+                    destination = self.landing(xpos + step, ypos) # Walking on, or dropping off a ledge
+                elif self.free(xpos, ypos - 1) and self.free(xpos + step, ypos - 1):
+                    destination = cell - width + step # Stepping up onto the block
+                if destination is not None: sources.setdefault(destination, []).append(cell)
+                destinations.append(destination)
+            moves[cell] = tuple(destinations)
+        self.moves, self.sources = moves, sources
+        self.stale = True
+
+    def update(self, target: Coords):
+        """Lead the flow field to a target, the standing cell under it. Nothing gets
+        worked out when neither the target's cell and column nor the terrain changed.
+
+        Args:
+            target (Coords): What to lead to, like the player's position.
+
+        Returns:
+            bool: Whether the field was worked out again."""
+        xpos = target.xpos - self.start
+        cell = self.landing(xpos, max(target.ypos, 0)) if 0 <= xpos < self.width else None
+        if (cell, xpos) == self.target and not self.stale: return False
+
+        steps = array('i', [NO_STEP]) * len(self.solid)
+        seen = bytearray(len(self.solid))
+        if cell is not None:
+            sources = self.sources
+            seen[cell] = 1
+            queue = deque((cell,))
+            while queue:
+                destination = queue.popleft()
+                for source in sources.get(destination, ()):
+                    if seen[source]: continue
+                    seen[source] = 1
+                    steps[source] = destination
+                    queue.append(source)
+        # The cells the search never got to, staying put is a step to the cell itself
+        width = self.width
+        for source, (left, right) in self.moves.items():
+            if seen[source]: continue
+            column = source % width
+            towards = left if xpos < column else right if xpos > column else None
+            steps[source] = towards if towards is not None else source
+        self.steps = steps
+        self.target = (cell, xpos)
+        self.stale = False
+        return True
+
+    def next_step(self, pos: Coords):
+        """Get where to move next to get closer to the target.
+
+        Args:
+            pos (Coords): Where the mover is.
+
+        Returns:
+            Coords: The next cell, the same cell to stay put, None if the mover isn't standing in the window."""
+        xpos = pos.xpos - self.start
+        if not (0 <= xpos < self.width and 0 <= pos.ypos < self.height): return None
+        step = self.steps[pos.ypos * self.width + xpos]
+        if step == NO_STEP: return None
+        return Coords(self.start + step % self.width, step // self.width)
@@ -1,3 +1,10 @@
 class MagicNumbers:
     GROUND_WIDTH = 80
+    SCREEN_WIDTH = 80
+    SCREEN_HEIGHT = 12
     STARTING_POWERSTATE = 0
+    TICK_RATE = 10 # Simulation ticks per second, the game's speed is tuned for this
+    RENDER_RATE = 30 # Frames drawn per second at most
+    CHUNK_WIDTH = 32 # Width of the slices the world is streamed in
+    CHUNK_MARGIN = 1 # Chunks kept loaded on each side of the screen
+    FIREBALL_POOL_SIZE = 16 # Fireballs preallocated per world, more get made when they are all flying
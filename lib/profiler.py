@@ -0,0 +1,200 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from lib.scheduler import PhaseTimer
+from lib.terminal_graphics import Terminal, Coords, Framebuffer
+from lib.parameters import MagicNumbers
+
+class Profiler(PhaseTimer):
+    """A PhaseTimer that also keeps the recent durations of each phase (for rolling
+    histograms and percentiles), per-frame counters like cells and bytes written, and
+    a trace of every phase that can be dumped in the Chrome trace event format, to be
+    opened in chrome://tracing or Perfetto.
+
+    It drops in wherever a PhaseTimer goes, so the phases of the game loop and the
+    world get profiled as they are. instrument() adds hooks around methods of the
+    entity classes, and draw_overlay() draws a one line HUD on the frame."""
+    # Upper bounds of the histogram buckets, in milliseconds
+    BUCKETS = (1, 2, 4, 8, 16, 33, 66, float('inf'))
+
+    def __init__(self, clock=time.perf_counter, history: int = 240, max_events: int = 200_000):
+        super().__init__(clock)
+        self.history = history
+        # Phase name -> the last history durations, in seconds
+        self.recent: dict = {}
+        # Counter name -> the last history samples
+        self.counters: dict = {}
+        self.events: deque = deque(maxlen=max_events) # Trace events, the oldest go first
+        self.origin = clock()
+        # Hooked methods, to put back the originals, see instrument
+        self.hooks: list = []
+        # Cells and bytes a presenter had written at the last sample_presenter
+        self.presenter_totals = (0, 0)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, self.clock() - start, start)
+
+    def record(self, name: str, duration: float, start: float = None, traced: bool = True):
+        """Add a measured duration to a phase.
+
+        Args:
+            name (str): The name of the phase.
+            duration (float): How long the phase took, in seconds.
+            start (float): When the phase started, by the profiler's clock.
+            traced (bool): Whether the phase goes in the trace, hooked methods are only counted.
+
+        Returns:
+            None"""
+        super().record(name, duration)
+        recent = self.recent.get(name)
+        if recent is None: recent = self.recent[name] = deque(maxlen=self.history)
+        recent.append(duration)
+        if traced and start is not None:
+            self.events.append({
+                'name': name, 'ph': 'X', 'pid': 1, 'tid': threading.get_native_id(),
+                'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6,
+            })
+
+    def count(self, name: str, value: float):
+        """Sample a counter, like the bytes written for a frame.
+
+        Args:
+            name (str): The name of the counter.
+            value (float): Its value.
+
+        Returns:
+            None"""
+        samples = self.counters.get(name)
+        if samples is None: samples = self.counters[name] = deque(maxlen=self.history)
+        samples.append(value)
+        self.events.append({
+            'name': name, 'ph': 'C', 'pid': 1, 'tid': threading.get_native_id(),
+            'ts': (self.clock() - self.origin) * 1e6, 'args': {name: value},
+        })
+
+    def sample_presenter(self, presenter):
+        """Count the cells and bytes a presenter wrote since the last sample.
+
+        Args:
+            presenter (FramePresenter): The presenter.
+
+        Returns:
+            None"""
+        last_cells, last_bytes = self.presenter_totals
+        self.count('cells', presenter.cells_written - last_cells)
+        self.count('bytes', presenter.bytes_written - last_bytes)
+        self.presenter_totals = (presenter.cells_written, presenter.bytes_written)
+
+    def histogram(self, name: str):
+        """Get how the recent durations of a phase spread over the BUCKETS.
+
+        Args:
+            name (str): The name of the phase.
+
+        Returns:
+            List[int]: How many durations fell in each bucket."""
+        buckets = [0] * len(Profiler.BUCKETS)
+        for duration in self.recent.get(name, ()):
+            milliseconds = duration * 1000
+            for number, bound in enumerate(Profiler.BUCKETS):
+                if milliseconds <= bound:
+                    buckets[number] += 1
+                    break
+        return buckets
+
+    def percentile(self, name: str, fraction: float):
+        """Get a percentile of the recent durations of a phase.
+
+        Args:
+            name (str): The name of the phase.
+            fraction (float): Which percentile, 0.95 for the 95th.
+
+        Returns:
+            float: The duration, in milliseconds, 0 if the phase never ran."""
+        recent = sorted(self.recent.get(name, ()))
+        if not recent: return 0
+        return recent[min(int(len(recent) * fraction), len(recent) - 1)] * 1000
+
+    def instrument(self, cls, *names: str):
+        """Hook methods of a class so every call gets recorded as a phase named
+        after them, like 'Fireball.render'. The calls are counted but not traced,
+        there can be hundreds of them per frame.
+
+        Args:
+            cls (type): The class.
+            names (str): The methods, the ones the class inherits are left alone.
+
+        Returns:
+            None"""
+        for name in names:
+            method = cls.__dict__.get(name)
+            if method is None: continue
+            self.hooks.append((cls, name, method))
+            setattr(cls, name, self.hook(f'{cls.__name__}.{name}', method))
+
+    def hook(self, phase: str, method):
+        clock, record = self.clock, self.record
+
+        @wraps(method)
+        def hooked(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                record(phase, clock() - start, traced=False)
+        return hooked
+
+    def uninstrument(self):
+        for cls, name, method in reversed(self.hooks): setattr(cls, name, method)
+        self.hooks.clear()
+
+    def overlay_text(self):
+        # The frame time, its 95th percentile and worst case, the main phases of the last frame and what got written
+        recent_frames = self.recent.get('frame', ())
+        worst = max(recent_frames, default=0) * 1000
+        parts = [f"frame {self.percentile('frame', 0.5):.1f}ms p95 {self.percentile('frame', 0.95):.1f} max {worst:.1f}"]
+        for name in ('tick', 'render', 'present'):
+            if name in self.phases: parts.append(f"{name} {self.phases[name][0] * 1000:.1f}")
+        written = [f"{self.counters[name][-1]:.0f}{name[0]}" for name in ('cells', 'bytes') if self.counters.get(name)]
+        if written: parts.append(' '.join(written))
+        return ' | '.join(parts)
+
+    def draw_overlay(self, screen):
+        """Draw a compact line of timings on the bottom row of a frame.
+
+        Args:
+            screen (Framebuffer): The frame.
+
+        Returns:
+            None"""
+        width = getattr(screen, 'width', MagicNumbers.SCREEN_WIDTH)
+        height = getattr(screen, 'height', MagicNumbers.SCREEN_HEIGHT)
+        text = self.overlay_text()[:width]
+        # The timings are new text every frame, written as they are rather than parsed into the sprite cache
+        if isinstance(screen, Framebuffer): screen.put_text(0, height - 1, text)
+        else: Terminal.place_text(screen, text, Coords(0, height - 1))
+
+    def trace(self):
+        """Get the trace in the Chrome trace event format.
+
+        Returns:
+            Dict: The trace, ready to be written as JSON."""
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def dump_trace(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.trace(), file)
+
+    def reset(self):
+        super().reset()
+        self.recent.clear()
+        self.counters.clear()
+        self.events.clear()
@@ -0,0 +1,145 @@
+import struct
+import zlib
+
+MAGIC = b'TPER'
+VERSION = 1
+# Magic, version, tick count, length of the level name
+HEADER = struct.Struct('<4sHIH')
+
+# Action -> code in a replay file, and back
+ACTION_CODES = {'left': 1, 'right': 2, 'jump': 3, 'shoot': 4}
+CODE_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+
+class ReplayError(Exception): pass
+
+class Recorder:
+    """Records the actions applied on each tick of a session. In a file every tick
+    is a byte with how many actions it had followed by a byte per action, and the
+    whole thing is compressed, so idle ticks cost next to nothing."""
+    def __init__(self, level: str = ''):
+        self.level = level # Where the world came from, a level file path or '' for the demo level
+        self.ticks: list = []
+
+    def record_tick(self, actions):
+        """Record the actions of the next tick.
+
+        Args:
+            actions (Iterable[str]): The actions, in the order they got applied.
+
+        Returns:
+            None"""
+        self.ticks.append(tuple(actions))
+
+    def encode(self):
+        body = bytearray()
+        for actions in self.ticks:
+            body.append(len(actions))
+            body.extend(ACTION_CODES[action] for action in actions)
+        level = self.level.encode()
+        return HEADER.pack(MAGIC, VERSION, len(self.ticks), len(level)) + level + zlib.compress(bytes(body))
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            file.write(self.encode())
+
+def decode(data: bytes):
+    """Read a replay.
+
+    Args:
+        data (bytes): The content of a replay file.
+
+    Returns:
+        Recorder: The recorded level and ticks."""
+    if len(data) < HEADER.size:
+        raise ReplayError('Too short to be a replay')
+    magic, version, tick_count, level_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ReplayError('Not a replay')
+    if version != VERSION:
+        raise ReplayError(f'Version {version} replay, only version {VERSION} is supported')
+    level_end = HEADER.size + level_length
+    recording = Recorder(data[HEADER.size:level_end].decode())
+
+    body = zlib.decompress(data[level_end:])
+    position = 0
+    for _ in range(tick_count):
+        count = body[position]
+        recording.ticks.append(tuple(CODE_ACTIONS[code] for code in body[position + 1:position + 1 + count]))
+        position += 1 + count
+    return recording
+
+def load(path: str):
+    with open(path, 'rb') as file:
+        return decode(file.read())
+
+class ReplayPlayer:
+    """Feeds a recording back into a world, tick by tick. The simulation only depends
+    on the actions of each tick, so the world goes through the exact same states as
+    during the recorded session, as fast as it can be stepped.
+
+    The world is snapshotted every snapshot_interval ticks (see World.snapshot), seeking
+    restores the closest snapshot before the wanted tick and steps forward from there.
+
+    A recording of a session that ended in a game over ends with the tick that raised
+    game_over, the replay stops there and keeps why in ending."""
+    def __init__(self, recording: Recorder, world, snapshot_interval: int = 100, game_over: type = ()):
+        self.recording = recording
+        self.world = world
+        self.tick = 0 # Ticks of the recording already applied to the world
+        self.snapshot_interval = snapshot_interval
+        self.game_over = game_over # What the world raises when the game ends, like Player.GameOverException
+        self.ending: str = None # Why the replay stopped before the end of the recording, None while it didn't
+        self.snapshots: dict = {}
+        self.take_snapshot()
+
+    def finished(self):
+        return self.ending is not None or self.tick >= len(self.recording.ticks)
+
+    def take_snapshot(self):
+        self.snapshots[self.tick] = self.world.snapshot()
+
+    def step(self):
+        """Apply the next tick of the recording.
+
+        Returns:
+            bool: Whether there was a tick left to apply."""
+        if self.finished(): return False
+        for action in self.recording.ticks[self.tick]:
+            self.world.apply_action(action)
+        try:
+            self.world.tick()
+        except self.game_over:
+            # The recorded session ended on this tick, it still counts as applied
+            self.tick += 1
+            self.ending = 'game over'
+            return True
+        self.tick += 1
+        if self.tick % self.snapshot_interval == 0 and self.tick not in self.snapshots:
+            self.take_snapshot()
+        return True
+
+    def fast_forward(self, tick: int):
+        """Step the recording up to a tick, without rendering anything.
+
+        Args:
+            tick (int): The tick to stop at.
+
+        Returns:
+            None"""
+        while self.tick < tick and self.step(): pass
+
+    def seek(self, tick: int):
+        """Put the world in the state it had at a tick, going back in time if needed.
+
+        Args:
+            tick (int): The tick to go to.
+
+        Returns:
+            None"""
+        if tick < self.tick or tick - self.tick > self.snapshot_interval:
+            start = max((taken for taken in self.snapshots if taken <= tick), default=0)
+            if start > self.tick or tick < self.tick:
+                self.world.restore(self.snapshots[start])
+                self.tick = start
+                self.ending = None
+        self.fast_forward(tick)
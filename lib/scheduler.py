@@ -0,0 +1,199 @@
+import time
+from contextlib import contextmanager
+
+class PhaseTimer:
+    """Measures how long each phase of a tick or frame (physics, render, present...)
+    takes, keeping the last duration, a running total and the worst case of each."""
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # Phase name -> [last duration, total duration, call count, max duration], in seconds
+        self.phases: dict = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the code inside the with block as the given phase.
+
+        Args:
+            name (str): The name of the phase.
+
+        Returns:
+            None"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, self.clock() - start)
+
+    def record(self, name: str, duration: float):
+        """Add a measured duration to a phase.
+
+        Args:
+            name (str): The name of the phase.
+            duration (float): How long the phase took, in seconds.
+
+        Returns:
+            None"""
+        stats = self.phases.get(name)
+        if stats is None:
+            self.phases[name] = [duration, duration, 1, duration]
+            return
+        stats[0] = duration
+        stats[1] += duration
+        stats[2] += 1
+        if duration > stats[3]: stats[3] = duration
+
+    def report(self):
+        """Get the timings of every phase.
+
+        Returns:
+            Dict[str, Dict[str, float]]: The last, average and max duration of each phase, in milliseconds."""
+        return {
+            name: {'last': last * 1000, 'average': total / count * 1000, 'max': worst * 1000}
+            for name, (last, total, count, worst) in self.phases.items()
+        }
+
+    def format_report(self):
+        """Get the timings of every phase as a single line, handy for logging.
+
+        Returns:
+            str: The average and max of each phase, in milliseconds."""
+        return ' | '.join(
+            f"{name}: {timing['average']:.3f}ms avg, {timing['max']:.3f}ms max"
+            for name, timing in self.report().items()
+        )
+
+    def reset(self):
+        self.phases.clear()
+
+class FixedTimestepLoop:
+    """Runs the simulation at a fixed tick rate with an accumulator, and renders at
+    its own rate. When the loop falls behind it runs several ticks per frame, up to
+    max_ticks_per_frame, and drops the rest of the backlog instead of spiralling."""
+    def __init__(self, tick_rate: float, render_rate: float = None, max_ticks_per_frame: int = 5,
+                 clock=time.perf_counter, sleep=time.sleep, timer: PhaseTimer = None):
+        self.step = 1 / tick_rate
+        self.render_interval = 1 / render_rate if render_rate else self.step
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.clock = clock
+        self.sleep = sleep
+        self.timer = timer if timer is not None else PhaseTimer(clock)
+        self.running = False
+
+        self.ticks = 0 # Simulation ticks that ran
+        self.frames = 0 # Frames that got rendered
+        self.dropped_ticks = 0 # Ticks dropped because the loop was too far behind
+        self.skipped_frames = 0 # Frames skipped because rendering was behind
+
+    def stop(self):
+        self.running = False
+
+    def set_render_rate(self, render_rate: float):
+        # Takes effect from the next frame on, the tick rate stays the same
+        self.render_interval = 1 / render_rate
+
+    def run(self, tick, render):
+        """Run the loop until stop() gets called.
+
+        Args:
+            tick (Callable[[], None]): Advances the simulation by one fixed step.
+            render (Callable[[float], None]): Draws a frame, gets how far (0 to 1) the
+                simulation is into the next tick, for renderers that interpolate.
+
+        Returns:
+            None"""
+        self.running = True
+        accumulator = 0.0
+        previous = self.clock()
+        next_render = previous
+
+        while self.running:
+            now = self.clock()
+            accumulator += now - previous
+            previous = now
+
+            ticks_this_frame = 0
+            while accumulator >= self.step and self.running:
+                if ticks_this_frame == self.max_ticks_per_frame:
+                    # Too far behind to ever catch up, let the backlog go
+                    dropped = int(accumulator // self.step)
+                    self.dropped_ticks += dropped
+                    accumulator -= dropped * self.step
+                    break
+                with self.timer.phase('tick'):
+                    tick()
+                self.ticks += 1
+                ticks_this_frame += 1
+                accumulator -= self.step
+
+            if not self.running: break
+
+            now = self.clock()
+            if now >= next_render:
+                with self.timer.phase('frame'):
+                    render(accumulator / self.step)
+                self.frames += 1
+                next_render += self.render_interval
+                if next_render < now:
+                    # Rendering is behind, skip the frames that are already late
+                    skipped = int((now - next_render) // self.render_interval) + 1
+                    self.skipped_frames += skipped
+                    next_render += skipped * self.render_interval
+
+            # Sleep until whatever comes first, the next tick or the next frame
+            next_tick = now + (self.step - accumulator)
+            delay = min(next_tick, next_render) - self.clock()
+            if delay > 0: self.sleep(delay)
+
+class AdaptiveRenderRate:
+    """Adapts a loop's render rate to how fast the output gets taken by the terminal,
+    so players on congested links get a lower frame rate instead of stalls.
+
+    The rate gets halved, down to min_rate, whenever a frame took longer than a frame
+    interval to be written or the oldest pending output is older than a frame interval,
+    and goes back up by a quarter every second, up to the loop's own rate, once frames
+    get written well within their interval again."""
+    def __init__(self, loop: FixedTimestepLoop, min_rate: float = 2, clock=time.perf_counter):
+        self.loop = loop
+        self.max_rate = 1 / loop.render_interval
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = self.max_rate
+        self.clock = clock
+        self.last_change = clock()
+        self.lowered = 0 # Times the rate got lowered
+        self.raised = 0 # Times it got raised
+        self.frames_sent = 0 # Frames sent as of the last update, only the latency of new ones counts
+
+    def update(self, output: dict):
+        """Adapt the render rate to the output's stats, once per frame.
+
+        Args:
+            output (dict): Stats of the output, see FramePresenter.stats, with pending_bytes,
+                frames_sent, latency_last_ms and backlog_age_ms.
+
+        Returns:
+            float: The render rate."""
+        interval = 1 / self.rate
+        now = self.clock()
+        latency = output.get('latency_last_ms', 0) / 1000
+        backlog = output.get('backlog_age_ms', 0) / 1000
+        new_frames = output.get('frames_sent', 0) != self.frames_sent
+        self.frames_sent = output.get('frames_sent', 0)
+        congested = backlog > interval or (new_frames and latency > interval)
+        if congested:
+            # One halving per interval is enough for what was written before it to show up
+            if now - self.last_change >= interval and self.rate > self.min_rate:
+                self.set_rate(max(self.min_rate, self.rate / 2), now)
+                self.lowered += 1
+        elif not output.get('pending_bytes') and latency < interval / 2:
+            if now - self.last_change >= 1 and self.rate < self.max_rate:
+                self.set_rate(min(self.max_rate, self.rate * 1.25), now)
+                self.raised += 1
+        return self.rate
+
+    def set_rate(self, rate: float, now: float):
+        self.rate = rate
+        self.last_change = now
+        self.loop.set_render_rate(rate)
+
+    def stats(self):
+        return {'render_rate': self.rate, 'rate_lowered': self.lowered, 'rate_raised': self.raised}
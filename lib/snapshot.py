@@ -0,0 +1,78 @@
+from typing import NamedTuple
+
+MISSING = object() # State of the keys the snapshotter has never seen
+
+class Snapshot(NamedTuple):
+    """The state of a world at a tick.
+
+    Most snapshots are deltas: changes only holds the entries that changed since
+    base, the snapshot taken before. Every keyframe_interval snapshots a keyframe
+    (base is None) holds every entry, so resolving a snapshot never walks a long chain."""
+    tick: int
+    base: 'Snapshot'
+    changes: dict # Key -> state, only what changed since base unless this is a keyframe
+    whole: tuple # State that is small enough to be kept whole in every snapshot
+    depth: int # Snapshots since the last keyframe
+
+class Snapshotter:
+    """Takes delta snapshots of keyed states. It remembers the state each key had
+    in the last snapshot, the owner only has to hand over the entries that might
+    have changed since then, so a snapshot costs as much as what changed."""
+    def __init__(self, keyframe_interval: int = 64):
+        self.keyframe_interval = keyframe_interval
+        self.known: dict = {} # Key -> state, as of the last snapshot
+        self.last: Snapshot = None
+
+    def capture(self, tick: int, entries, whole: tuple = ()):
+        """Take a snapshot.
+
+        Args:
+            tick (int): The tick the snapshot is taken at.
+            entries (Iterable[Tuple[key, state]]): Every entry that might have changed since the last snapshot,
+                the first snapshot needs all of them. States have to be immutable and comparable.
+            whole (tuple): State kept as is in the snapshot.
+
+        Returns:
+            Snapshot: The snapshot."""
+        known = self.known
+        changes = {}
+        for key, state in entries:
+            if known.get(key, MISSING) != state:
+                changes[key] = known[key] = state
+        last = self.last
+        if last is None or last.depth + 1 >= self.keyframe_interval:
+            snapshot = Snapshot(tick, None, dict(known), whole, 0)
+        else:
+            snapshot = Snapshot(tick, last, changes, whole, last.depth + 1)
+        self.last = snapshot
+        return snapshot
+
+    @staticmethod
+    def resolve(snapshot: Snapshot):
+        """Get the state of every key in a snapshot.
+
+        Args:
+            snapshot (Snapshot): The snapshot.
+
+        Returns:
+            dict: Key -> state."""
+        chain = []
+        while snapshot is not None:
+            chain.append(snapshot.changes)
+            snapshot = snapshot.base
+        states = dict(chain.pop()) # The keyframe
+        for changes in reversed(chain): states.update(changes)
+        return states
+
+    def rewind(self, snapshot: Snapshot, states: dict = None):
+        """Make a restored snapshot the base of the next one. Snapshots taken after it
+        are left alone, so the timeline can branch off from any snapshot.
+
+        Args:
+            snapshot (Snapshot): The snapshot that got restored.
+            states (dict): The snapshot's resolved states, the snapshotter takes them over. Resolved again when not given.
+
+        Returns:
+            None"""
+        self.known = states if states is not None else self.resolve(snapshot)
+        self.last = snapshot
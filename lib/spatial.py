@@ -0,0 +1,111 @@
+from lib.terminal_graphics import Coords
+
+class SpatialHash:
+    """Maps each cell of the world to the objects occupying it, one table per layer
+    (ground, bricks, enemies...), so collision checks are a single dict lookup
+    instead of a scan over every object of the level."""
+    EMPTY = ()
+
+    def __init__(self):
+        # Layer name -> {(x, y): [objects]}
+        self.layers: dict = {}
+        # Layer name -> function giving the objects in a cell, for layers that keep track
+        # of their own objects, like terrain in a tile grid or entities in an entity store
+        self.lookups: dict = {}
+
+    def attach(self, layer: str, lookup):
+        """Let a layer be looked up through a function instead of cells inserted in the index.
+
+        Args:
+            layer (str): The layer.
+            lookup (Callable[[int, int], Sequence]): Gives the objects in the cell at x, y.
+
+        Returns:
+            None"""
+        self.lookups[layer] = lookup
+
+    def attach_tiles(self, layer: str, tiles, code: int, obj):
+        """Make the cells of a tile grid holding a tile code count as occupied by an object.
+
+        Args:
+            layer (str): The layer the tiles belong to.
+            tiles (TileLayer): The tile grid, anything with an at(x, y) method.
+            code (int): The tile code that occupies a cell.
+            obj: The object reported for those cells.
+
+        Returns:
+            None"""
+        occupants = (obj,)
+        self.attach(layer, lambda xpos, ypos: occupants if tiles.at(xpos, ypos) == code else SpatialHash.EMPTY)
+        obj.index = self
+
+    def insert(self, obj, pos: Coords = None, layer: str = None):
+        """Add an object to the index.
+
+        Args:
+            obj: The object to add, its layer attribute picks the table it goes in.
+            pos (Coords): The cell it occupies, defaults to the object's position.
+            layer (str): Overrides the layer of the object.
+
+        Returns:
+            None"""
+        pos = obj.pos if pos is None else pos
+        cells = self.layers.setdefault(layer or obj.layer, {})
+        # Coords hash like (x, y) tuples, so they are the keys as they are
+        cells.setdefault(pos, []).append(obj)
+        # Lets the object keep the index up to date by itself when it moves or breaks
+        obj.index = self
+
+    def remove(self, obj, pos: Coords = None, layer: str = None):
+        """Remove an object from the index, doing nothing if it is not in there.
+
+        Args:
+            obj: The object to remove.
+            pos (Coords): The cell it occupies, defaults to the object's position.
+            layer (str): Overrides the layer of the object.
+
+        Returns:
+            None"""
+        pos = obj.pos if pos is None else pos
+        cells = self.layers.get(layer or obj.layer)
+        if cells is None: return
+        occupants = cells.get(pos)
+        if occupants is None or obj not in occupants: return
+        occupants.remove(obj)
+        if not occupants: del cells[pos]
+
+    def move(self, obj, old_pos: Coords, new_pos: Coords):
+        """Move an object of the index from a cell to another one.
+
+        Args:
+            obj: The object that moved.
+            old_pos (Coords): The cell it was in.
+            new_pos (Coords): The cell it is in now.
+
+        Returns:
+            None"""
+        if old_pos == new_pos: return
+        self.remove(obj, old_pos)
+        self.insert(obj, new_pos)
+
+    def at(self, layer: str, xpos: int, ypos: int):
+        """Get the objects of a layer occupying a cell.
+
+        Args:
+            layer (str): The layer to look in.
+            xpos (int): The x position of the cell.
+            ypos (int): The y position of the cell.
+
+        Returns:
+            List: The objects in the cell, empty if there are none."""
+        cells = self.layers.get(layer)
+        if cells is not None:
+            occupants = cells.get((xpos, ypos))
+            if occupants: return occupants
+        lookup = self.lookups.get(layer)
+        if lookup is not None: return lookup(xpos, ypos)
+        return SpatialHash.EMPTY
+
+    def clear(self):
+        self.layers.clear()
+        self.lookups.clear()
@@ -0,0 +1,316 @@
+"""Spectator mode, the frames of a game streamed live to any number of viewers.
+
+The game hands every frame to a SpectatorServer, which encodes the cells that changed
+once, as the same escape sequences a terminal gets (see FramePresenter), and sends
+those bytes to every viewer connected to a Unix socket or a localhost TCP port. A
+viewer only has to write what it gets to its terminal.
+
+A viewer that can't keep up doesn't get an ever growing backlog: once more than
+max_backlog bytes are waiting to be sent to it, it stops getting deltas, and once it
+caught up it gets a keyframe, the whole frame drawn on a cleared screen, and goes on
+with deltas from there. New viewers start with a keyframe too.
+
+    python Engine.py --spectate /tmp/game.sock    # or --spectate 7777, for localhost:7777
+    python -m lib.spectator /tmp/game.sock        # Watch it
+"""
+import os
+import sys
+import stat
+import socket
+import asyncio
+import threading
+from lib.terminal_graphics import Framebuffer, FramePresenter
+
+CLEAR = b'\033[2J\033[H'
+HIDE_CURSOR = b'\033[?25l'
+SHOW_CURSOR = b'\033[?25h'
+RESET = b'\033[0m'
+
+def parse_address(address: str):
+    """Work out where to listen or connect.
+
+    Args:
+        address (str): A Unix socket path (anything with a '/', or 'unix:' and a path),
+            or a TCP port, optionally with a host in front of it ('7777', 'localhost:7777').
+
+    Returns:
+        Tuple[str, object]: ('unix', path) or ('tcp', (host, port))."""
+    if address.startswith('unix:'): return 'unix', address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if '/' in address or not port.isdigit(): return 'unix', address
+    return 'tcp', (host or 'localhost', int(port))
+
+def remove_stale_socket(path: str):
+    """Remove the socket of a session that ended without cleaning up, so a new one can
+    listen there. Anything else at the path is left alone.
+
+    Args:
+        path (str): Where the socket is.
+
+    Returns:
+        None"""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f'{path} already exists and is not a socket')
+    # A socket nothing listens on anymore refuses connections
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f'{path} is the socket of a session that is still running')
+
+class EncodedStream:
+    """Keeps what a FramePresenter writes, to be sent elsewhere."""
+    def __init__(self):
+        self.parts: list = []
+
+    def write(self, data: str):
+        self.parts.append(data)
+        return len(data)
+
+    def flush(self): pass
+
+    def take(self):
+        # Everything written since the last take, encoded
+        data = ''.join(self.parts).encode()
+        self.parts.clear()
+        return data
+
+class Viewer:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        # Whether the viewer shows the frame the next delta applies to, it gets a keyframe otherwise
+        self.synced = False
+
+class SpectatorServer:
+    """Streams the frames of a game to viewers, from an asyncio event loop running in
+    a thread of its own so the game loop never waits on a viewer.
+
+    publish() copies a frame into a back buffer and wakes the event loop up, which
+    encodes the frame's changes once and fans the same bytes out to every viewer.
+    Frames published before the event loop got to the previous one replace it,
+    like PresenterThread does."""
+    def __init__(self, address: str, max_backlog: int = 64 * 1024):
+        self.address = address
+        self.max_backlog = max_backlog # Bytes waiting to be sent to a viewer before it gets resynced
+        self.encoded = EncodedStream()
+        self.presenter = FramePresenter(self.encoded)
+        self.back: Framebuffer = None # The newest frame, waiting to be encoded
+        self.front: Framebuffer = None # The last encoded frame, what synced viewers show
+        self.waiting = False
+        self.lock = threading.Lock()
+        self.keyframe_data: bytes = None # Keyframe of the front frame, made when a viewer needs one
+        self.viewers: set = set()
+        self.handlers: set = set() # Tasks serving the viewers' connections
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stopping: asyncio.Event = None
+        self.thread: threading.Thread = None
+        self.started = threading.Event()
+        self.error: BaseException = None # What kept the server from starting, raised by start
+        self.socket_id: tuple = None # Device and inode of the Unix socket this server made, only that one gets removed
+        # Running totals, see stats
+        self.frames_published = 0
+        self.frames_dropped = 0
+        self.frames_encoded = 0
+        self.bytes_encoded = 0
+        self.bytes_sent = 0
+        self.keyframes_sent = 0
+        self.resyncs = 0
+
+    def start(self):
+        """Start listening, in a thread of its own.
+
+        Returns:
+            None"""
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name='spectators', daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None: raise self.error
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        kind, where = parse_address(self.address)
+        try:
+            if kind == 'unix':
+                remove_stale_socket(where)
+                server = await asyncio.start_unix_server(self.on_connect, where)
+                made = os.stat(where)
+                self.socket_id = (made.st_dev, made.st_ino)
+            else:
+                server = await asyncio.start_server(self.on_connect, *where)
+        except OSError as error:
+            self.error = error
+            return
+        finally:
+            self.started.set()
+        async with server:
+            await self.stopping.wait()
+        # Closing the connections ends their handlers, which have to be done before the event loop is
+        for viewer in tuple(self.viewers): viewer.writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        if self.socket_id is not None: self.remove_socket(where)
+
+    def remove_socket(self, path: str):
+        # Only when it is still the socket this server made, not whatever replaced it since
+        try:
+            found = os.stat(path)
+        except FileNotFoundError:
+            return
+        if (found.st_dev, found.st_ino) == self.socket_id: os.unlink(path)
+
+    def publish(self, fb: Framebuffer):
+        """Hand a frame over to be streamed, it can be drawn on again right away.
+
+        Args:
+            fb (Framebuffer): The frame.
+
+        Returns:
+            None"""
+        with self.lock:
+            if self.back is None or self.back.size != fb.size:
+                self.back = Framebuffer(fb.width, fb.height)
+            if self.waiting: self.frames_dropped += 1 # The event loop never got to it
+            self.back.copy_from(fb)
+            self.back.origin_x = fb.origin_x
+            wake = not self.waiting
+            self.waiting = True
+            self.frames_published += 1
+        if wake: self.loop.call_soon_threadsafe(self.broadcast)
+
+    def broadcast(self):
+        # Encode the newest frame's changes once, then send them to every viewer
+        with self.lock:
+            if not self.waiting: return
+            self.back, self.front = self.front, self.back
+            self.waiting = False
+        self.presenter.present(self.front)
+        delta = self.encoded.take()
+        self.keyframe_data = None
+        self.frames_encoded += 1
+        self.bytes_encoded += len(delta)
+        for viewer in tuple(self.viewers): self.send(viewer, delta)
+
+    def send(self, viewer: Viewer, delta: bytes):
+        """Send a frame's delta to a viewer, or a keyframe when the viewer missed deltas
+        and has caught up since.
+
+        Args:
+            viewer (Viewer): The viewer.
+            delta (bytes): The encoded changes of the frame.
+
+        Returns:
+            None"""
+        transport = viewer.writer.transport
+        if transport.is_closing():
+            self.viewers.discard(viewer)
+            return
+        backlog = transport.get_write_buffer_size()
+        if viewer.synced and backlog > self.max_backlog:
+            # Too far behind, the deltas get dropped until the backlog went out
+            viewer.synced = False
+            self.resyncs += 1
+        if viewer.synced:
+            data = delta
+        elif backlog <= self.max_backlog // 4:
+            data = self.keyframe()
+            viewer.synced = True
+            self.keyframes_sent += 1
+        else:
+            return
+        if data:
+            viewer.writer.write(data)
+            self.bytes_sent += len(data)
+
+    def keyframe(self):
+        # The whole front frame on a cleared screen, made once per frame however many viewers need it
+        if self.keyframe_data is None:
+            encoded = EncodedStream()
+            if self.front is not None: FramePresenter(encoded).present(self.front)
+            self.keyframe_data = CLEAR + encoded.take()
+        return self.keyframe_data
+
+    async def on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        viewer = Viewer(writer)
+        self.handlers.add(asyncio.current_task())
+        writer.write(HIDE_CURSOR)
+        self.send(viewer, b'')
+        self.viewers.add(viewer)
+        try:
+            # Viewers never send anything, reading only tells when they leave
+            while await reader.read(4096): pass
+        except ConnectionError:
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            self.handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def stop(self):
+        """Disconnect every viewer and stop listening.
+
+        Returns:
+            None"""
+        if self.thread is None: return
+        if self.loop is not None and self.stopping is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        """Get how the streaming went so far.
+
+        Returns:
+            Dict[str, int]: The viewers connected right now and the running totals."""
+        return {
+            'viewers': len(self.viewers),
+            'frames_published': self.frames_published,
+            'frames_dropped': self.frames_dropped,
+            'frames_encoded': self.frames_encoded,
+            'bytes_encoded': self.bytes_encoded,
+            'bytes_sent': self.bytes_sent,
+            'keyframes_sent': self.keyframes_sent,
+            'resyncs': self.resyncs,
+        }
+
+def watch(address: str, out=None):
+    """Show a spectated game, until it ends or Ctrl+C.
+
+    Args:
+        address (str): Where the game streams to, see parse_address.
+        out: Where to write the frames, defaults to the terminal.
+
+    Returns:
+        None"""
+    out = out if out is not None else sys.stdout.buffer
+    kind, where = parse_address(address)
+    if kind == 'unix':
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(where)
+    else:
+        connection = socket.create_connection(where)
+    try:
+        with connection:
+            while True:
+                data = connection.recv(65536)
+                if not data: break
+                out.write(data)
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.write(RESET + SHOW_CURSOR + b'\n')
+        out.flush()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python -m lib.spectator ADDRESS')
+        sys.exit(1)
+    watch(sys.argv[1])
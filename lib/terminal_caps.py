@@ -0,0 +1,119 @@
+import os
+import sys
+
+TRUECOLOR = 'truecolor'
+COLOR256 = '256'
+COLOR16 = '16'
+
+# RGB values of the 16 basic ANSI colors, as xterm draws them
+BASIC_COLORS = (
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+    (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+)
+# Levels of each channel in the 6x6x6 color cube of 256 color terminals
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+_detected: str = None
+
+def terminfo_colors(stream=None):
+    """Ask terminfo how many colors the terminal has.
+
+    Args:
+        stream: The stream the terminal is on.
+
+    Returns:
+        int: The number of colors, 0 if terminfo can't tell."""
+    stream = stream if stream is not None else sys.stdout
+    try:
+        import curses
+        curses.setupterm(fd=stream.fileno())
+        return max(curses.tigetnum('colors'), 0)
+    except Exception: # No curses, no terminfo entry, or not a real terminal
+        return 0
+
+def detect_color_mode(environ=None, stream=None, refresh: bool = False):
+    """Work out the richest color encoding the terminal supports, from COLORTERM,
+    TERM and then terminfo. The result is cached, the first call does the work.
+
+    Args:
+        environ (Mapping[str, str]): The environment to look at, defaults to os.environ.
+        stream: The stream the terminal is on, defaults to sys.stdout.
+        refresh (bool): Detect again instead of using the cached result.
+
+    Returns:
+        str: TRUECOLOR, COLOR256 or COLOR16."""
+    global _detected
+    if _detected is not None and not refresh: return _detected
+
+    environ = environ if environ is not None else os.environ
+    colorterm = environ.get('COLORTERM', '').lower()
+    term = environ.get('TERM', '').lower()
+    if colorterm in ('truecolor', '24bit') or term.endswith('-direct'):
+        _detected = TRUECOLOR
+    elif '256color' in term:
+        _detected = COLOR256
+    else:
+        colors = terminfo_colors(stream)
+        if colors >= 1 << 24: _detected = TRUECOLOR
+        elif colors >= 256: _detected = COLOR256
+        else: _detected = COLOR16
+    return _detected
+
+def distance(first: tuple, second: tuple):
+    return sum((a - b) ** 2 for a, b in zip(first, second))
+
+def rgb_of(color):
+    """Get the RGB value of an indexed color.
+
+    Args:
+        color (int): The 256 color index.
+
+    Returns:
+        Tuple[int, int, int]: The RGB value."""
+    if color < 16: return BASIC_COLORS[color]
+    if color < 232:
+        color -= 16
+        return CUBE_LEVELS[color // 36], CUBE_LEVELS[color // 6 % 6], CUBE_LEVELS[color % 6]
+    gray = 8 + (color - 232) * 10
+    return gray, gray, gray
+
+def to_256(rgb: tuple):
+    """Get the closest 256 color index, out of the color cube and the gray ramp.
+
+    Args:
+        rgb (Tuple[int, int, int]): The color.
+
+    Returns:
+        int: The 256 color index."""
+    cube = [min(range(6), key=lambda level: abs(CUBE_LEVELS[level] - channel)) for channel in rgb]
+    cube_index = 16 + cube[0] * 36 + cube[1] * 6 + cube[2]
+    gray_index = 232 + min(max(round((sum(rgb) / 3 - 8) / 10), 0), 23)
+    return min((cube_index, gray_index), key=lambda index: distance(rgb_of(index), rgb))
+
+def to_16(color):
+    """Get the closest basic ANSI color.
+
+    Args:
+        color: An RGB tuple or a 256 color index.
+
+    Returns:
+        int: The basic color index, 0 to 15."""
+    if isinstance(color, int):
+        if color < 16: return color
+        color = rgb_of(color)
+    return min(range(16), key=lambda index: distance(BASIC_COLORS[index], color))
+
+def convert_color(color, mode: str):
+    """Convert a color to what a color mode can display.
+
+    Args:
+        color: None, an indexed color or an RGB tuple.
+        mode (str): TRUECOLOR, COLOR256 or COLOR16.
+
+    Returns:
+        The converted color."""
+    if color is None or mode == TRUECOLOR: return color
+    if mode == COLOR256: return to_256(color) if isinstance(color, tuple) else color
+    return to_16(color)
@@ -1,12 +1,19 @@
 import os
+import re
 import sys
-from dataclasses import dataclass
+import time
+import select
+import threading
+from array import array
+from collections import deque
+from typing import NamedTuple
+from lib import terminal_caps
 
-@dataclass(eq=True, frozen=True)
-class Coords:
+class Coords(NamedTuple):
+    """A cell position. Being a tuple it takes no more memory than one, hashes and
+    compares at C speed, and equals (and hashes like) the (x, y) tuple of its cell."""
     xpos: int
     ypos: int
-    attributes: tuple = None
 
 class ScreenData(dict):
     def __setitem__(self, key, value):
@@ -22,10 +29,777 @@ class ScreenData(dict):
             raise TypeError(value_error)
         super().__setitem__(key, value)
 
+class Style(NamedTuple):
+    """The look of a cell, parsed from a sprite's SGR escape sequences.
+    Colors are None for the terminal's default, 0-255 for an indexed color
+    (0-15 being the basic ANSI ones) or an (r, g, b) tuple for truecolor."""
+    fg: object = None
+    bg: object = None
+    attrs: tuple = () # SGR attribute codes, like 1 for bold or 3 for italic, sorted
+
+    def apply_sgr(self, params: str):
+        """Get the style this one turns into after an SGR escape sequence.
+
+        Args:
+            params (str): The parameters of the sequence, like '38;2;255;0;0'.
+
+        Returns:
+            Style: The new style."""
+        codes = [int(code) if code else 0 for code in params.split(';')]
+        fg, bg, attrs = self.fg, self.bg, set(self.attrs)
+        position = 0
+        while position < len(codes):
+            code = codes[position]
+            if code == 0: fg, bg, attrs = None, None, set()
+            elif code in (38, 48):
+                # Extended colors, either 5;n for 256 colors or 2;r;g;b for truecolor
+                if codes[position + 1:position + 2] == [5]:
+                    color = codes[position + 2]
+                    position += 2
+                else:
+                    color = tuple(codes[position + 2:position + 5])
+                    position += 4
+                if code == 38: fg = color
+                else: bg = color
+            elif 30 <= code <= 37: fg = code - 30
+            elif 90 <= code <= 97: fg = code - 90 + 8
+            elif code == 39: fg = None
+            elif 40 <= code <= 47: bg = code - 40
+            elif 100 <= code <= 107: bg = code - 100 + 8
+            elif code == 49: bg = None
+            elif 1 <= code <= 9: attrs.add(code)
+            position += 1
+        return Style(fg, bg, tuple(sorted(attrs)))
+
+    @staticmethod
+    def color_params(color, base: int):
+        """Get the SGR parameters setting a color.
+
+        Args:
+            color: The color, see Style.
+            base (int): 38 for the foreground, 48 for the background.
+
+        Returns:
+            str: The parameters."""
+        offset = base - 38 # 0 for the foreground, 10 for the background
+        if color is None: return str(39 + offset)
+        if isinstance(color, tuple): return f"{base};2;{color[0]};{color[1]};{color[2]}"
+        if color < 8: return str(30 + offset + color)
+        if color < 16: return str(90 + offset + color - 8)
+        return f"{base};5;{color}"
+
+    def converted(self, mode: str):
+        """Get this style with its colors converted to what a color mode can display.
+
+        Args:
+            mode (str): One of the terminal_caps color modes.
+
+        Returns:
+            Style: The converted style."""
+        return Style(terminal_caps.convert_color(self.fg, mode), terminal_caps.convert_color(self.bg, mode), self.attrs)
+
+    def sgr(self):
+        """Get the escape sequence setting this style from the default one.
+
+        Returns:
+            str: The escape sequence, empty for the default style."""
+        params = [str(attr) for attr in self.attrs]
+        if self.fg is not None: params.append(Style.color_params(self.fg, 38))
+        if self.bg is not None: params.append(Style.color_params(self.bg, 48))
+        return f"\033[{';'.join(params)}m" if params else ''
+
+    def transition(self, new: 'Style'):
+        """Get the shortest escape sequence going from this style to another one.
+
+        Args:
+            new (Style): The style to go to.
+
+        Returns:
+            str: The escape sequence, empty if the styles are the same."""
+        if new == self: return ''
+        # Attributes can only be turned off one by one, a reset and a full style is simpler
+        if not set(self.attrs) <= set(new.attrs):
+            return '\033[0m' + new.sgr()
+        params = [str(attr) for attr in new.attrs if attr not in self.attrs]
+        if new.fg != self.fg: params.append(Style.color_params(new.fg, 38))
+        if new.bg != self.bg: params.append(Style.color_params(new.bg, 48))
+        return f"\033[{';'.join(params)}m"
+
+DEFAULT_STYLE = Style()
+
+class Framebuffer:
+    """A fixed-size screen stored as two flat arrays, one with the glyph code of
+    each cell and one with the index of its style in the shared palette.
+
+    It also behaves enough like a ScreenData dict (setitem, update, get, items)
+    for the render() methods written against ScreenData to keep working.
+
+    Positions are in world coordinates, origin_x being the world x position of
+    the leftmost column, except for put_screen which writes in screen coordinates."""
+    BLANK = ord(' ')
+    ESCAPE_PATTERN = re.compile(r'\033\[([0-9;]*)m')
+    RESET = '\033[0m'
+    SPRITE_CACHE_SIZE = 1024 # Parsed sprites kept at most, the oldest ones get dropped first
+
+    # Shared by every framebuffer so style indexes mean the same thing everywhere,
+    # style 0 is the terminal's default style
+    palette: list = [DEFAULT_STYLE]
+    style_ids: dict = {DEFAULT_STYLE: 0}
+    # The palette converted to the color mode of the terminal, which is what gets sent to it
+    color_mode: str = terminal_caps.TRUECOLOR
+    encoded_palette: list = [DEFAULT_STYLE]
+    # (from style index, to style index) -> escape sequence going from one to the other
+    transitions: dict = {}
+    # Sprite string -> tuple of (glyph code, style index) for each visible character,
+    # only for sprites, text that changes every frame is parsed each time (see put_text)
+    sprite_cache: dict = {}
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.origin_x = 0 # Moved by the camera to scroll the world
+        self.glyphs = array('I', [Framebuffer.BLANK]) * self.size
+        self.styles = array('H', [0]) * self.size
+        # Kept around so clear() is a couple of memory copies
+        self.blank_glyphs = array('I', self.glyphs)
+        self.blank_styles = array('H', self.styles)
+
+    @staticmethod
+    def style_id(style: Style):
+        """Get the palette index of a style, adding it to the palette if it is new.
+
+        Args:
+            style (Style): The style.
+
+        Returns:
+            int: The palette index of the style."""
+        style_ids = Framebuffer.style_ids
+        if style not in style_ids:
+            style_ids[style] = len(Framebuffer.palette)
+            Framebuffer.palette.append(style)
+            Framebuffer.encoded_palette.append(style.converted(Framebuffer.color_mode))
+        return style_ids[style]
+
+    @staticmethod
+    def set_color_mode(mode: str):
+        """Precompile the palette for a color mode, every style drawn from then
+        on gets sent in that mode's encoding.
+
+        Args:
+            mode (str): One of the terminal_caps color modes.
+
+        Returns:
+            None"""
+        Framebuffer.color_mode = mode
+        Framebuffer.encoded_palette = [style.converted(mode) for style in Framebuffer.palette]
+        Framebuffer.transitions.clear()
+
+    @staticmethod
+    def parse_sprite(sprite: str, cache: bool = True):
+        """Split a sprite into its cells, parsing each sprite only once.
+
+        Args:
+            sprite (str): The sprite, escape sequences included.
+            cache (bool): Whether to keep the cells for the next time, False for one-off text.
+
+        Returns:
+            Tuple[Tuple[int, int]]: The (glyph code, style index) of each cell."""
+        sprite_cache = Framebuffer.sprite_cache
+        cells = sprite_cache.get(sprite)
+        if cells is not None: return cells
+
+        cells = []
+        style = DEFAULT_STYLE
+        position = 0
+        for match in Framebuffer.ESCAPE_PATTERN.finditer(sprite):
+            for character in sprite[position:match.start()]:
+                cells.append((ord(character), Framebuffer.style_id(style)))
+            style = style.apply_sgr(match.group(1))
+            position = match.end()
+        for character in sprite[position:]:
+            cells.append((ord(character), Framebuffer.style_id(style)))
+
+        cells = tuple(cells)
+        if cache:
+            # Bounded, in case something keeps drawing new strings through put
+            if len(sprite_cache) >= Framebuffer.SPRITE_CACHE_SIZE: del sprite_cache[next(iter(sprite_cache))]
+            sprite_cache[sprite] = cells
+        return cells
+
+    def put(self, xpos: int, ypos: int, sprite: str):
+        """Write a sprite into the framebuffer, cells outside of it are dropped.
+
+        Args:
+            xpos (int): The world x position of the sprite's first cell.
+            ypos (int): The y position of the sprite.
+            sprite (str): The sprite to write.
+
+        Returns:
+            None"""
+        self.put_screen(xpos - self.origin_x, ypos, sprite)
+
+    def put_screen(self, xpos: int, ypos: int, sprite: str):
+        """Write a sprite at a fixed place of the screen, whatever the camera is looking at.
+
+        Args:
+            xpos (int): The screen x position of the sprite's first cell.
+            ypos (int): The y position of the sprite.
+            sprite (str): The sprite to write.
+
+        Returns:
+            None"""
+        if not 0 <= ypos < self.height: return
+        width = self.width
+        index = ypos * width + xpos
+        for glyph, style in Framebuffer.parse_sprite(sprite):
+            if 0 <= xpos < width:
+                self.glyphs[index] = glyph
+                self.styles[index] = style
+            xpos += 1
+            index += 1
+
+    def put_text(self, xpos: int, ypos: int, text: str):
+        """Write text at a fixed place of the screen without caching it, for HUD
+        lines that are different every frame.
+
+        Args:
+            xpos (int): The screen x position of the text's first cell.
+            ypos (int): The y position of the text.
+            text (str): The text, plain or with escape sequences.
+
+        Returns:
+            None"""
+        if not 0 <= ypos < self.height: return
+        if '\033' in text:
+            cells = Framebuffer.parse_sprite(text, cache=False)
+        else:
+            cells = [(ord(character), 0) for character in text] # Plain text is in the default style
+        width = self.width
+        index = ypos * width + xpos
+        for glyph, style in cells:
+            if 0 <= xpos < width:
+                self.glyphs[index] = glyph
+                self.styles[index] = style
+            xpos += 1
+            index += 1
+
+    def fill(self, pos: Coords, count: int, sprite: str):
+        """Write the same single-cell sprite into a run of cells on one row.
+
+        Args:
+            pos (Coords): The position of the first cell of the run.
+            count (int): How many cells the run is long.
+            sprite (str): The single-cell sprite to fill the run with.
+
+        Returns:
+            None"""
+        if not 0 <= pos.ypos < self.height: return
+        xpos = pos.xpos - self.origin_x
+        start = max(xpos, 0)
+        end = min(xpos + count, self.width)
+        if start >= end: return
+
+        glyph, style = Framebuffer.parse_sprite(sprite)[0]
+        row_start = pos.ypos * self.width
+        self.glyphs[row_start + start:row_start + end] = array('I', [glyph]) * (end - start)
+        self.styles[row_start + start:row_start + end] = array('H', [style]) * (end - start)
+
+    def row(self, ypos: int):
+        """Get the glyphs and styles of a row.
+
+        Args:
+            ypos (int): The row to get.
+
+        Returns:
+            Tuple[array, array]: The glyph codes and style indexes of the row."""
+        start = ypos * self.width
+        return self.glyphs[start:start + self.width], self.styles[start:start + self.width]
+
+    def cell(self, index: int):
+        """Get the sprite string of a cell from its flat index.
+
+        Args:
+            index (int): The flat index of the cell.
+
+        Returns:
+            str: The sprite of the cell, escape sequences included."""
+        style = self.styles[index]
+        glyph = chr(self.glyphs[index])
+        return f"{Framebuffer.palette[style].sgr()}{glyph}{Framebuffer.RESET}" if style else glyph
+
+    def clear(self):
+        self.glyphs[:] = self.blank_glyphs
+        self.styles[:] = self.blank_styles
+
+    def copy_from(self, other: 'Framebuffer'):
+        self.glyphs[:] = other.glyphs
+        self.styles[:] = other.styles
+
+    def copy_window(self, source: 'Framebuffer', xpos: int):
+        """Replace the content with the columns of a wider framebuffer starting at a world
+        x position, like a frame starting from a cached background. Columns the source
+        doesn't have are left blank.
+
+        Args:
+            source (Framebuffer): The framebuffer to copy from, as tall as this one.
+            xpos (int): The world x position of the leftmost column to copy.
+
+        Returns:
+            None"""
+        self.origin_x = xpos
+        offset = xpos - source.origin_x
+        width = self.width
+        start, end = max(-offset, 0), min(source.width - offset, width)
+        if start > 0 or end < width: self.clear()
+        if start >= end: return
+        glyphs, styles = self.glyphs, self.styles
+        for ypos in range(min(self.height, source.height)):
+            row = ypos * width
+            source_row = ypos * source.width + offset
+            glyphs[row + start:row + end] = source.glyphs[source_row + start:source_row + end]
+            styles[row + start:row + end] = source.styles[source_row + start:source_row + end]
+
+    # Everything below is the ScreenData compatible side of the framebuffer
+    def __setitem__(self, key: Coords, value: str):
+        if not isinstance(key, Coords):
+            raise TypeError('Framebuffer keys must be Coords objects')
+        if isinstance(value, bool):
+            value = '█' if value else ' '
+        if not isinstance(value, str):
+            raise TypeError('Framebuffer values must be strings')
+        self.put(key.xpos, key.ypos, value)
+
+    def __getitem__(self, key: Coords):
+        if key not in self:
+            raise KeyError(key)
+        return self.cell(key.ypos * self.width + key.xpos - self.origin_x)
+
+    def __contains__(self, key: Coords):
+        return 0 <= key.xpos - self.origin_x < self.width and 0 <= key.ypos < self.height
+
+    def get(self, key: Coords, default: str = None):
+        return self[key] if key in self else default
+
+    def update(self, other: dict):
+        for key, value in other.items():
+            self[key] = value
+
+    def items(self):
+        """Iterate over every cell that is not blank.
+
+        Returns:
+            Iterator[Tuple[Coords, str]]: The position and sprite of each cell."""
+        width = self.width
+        for index in range(self.size):
+            if self.glyphs[index] != Framebuffer.BLANK or self.styles[index]:
+                yield Coords(index % width + self.origin_x, index // width), self.cell(index)
+
+class NullStream:
+    """A stream that throws away everything written to it, for running without a terminal."""
+    def write(self, data: str): return len(data)
+    def flush(self): pass
+
+class NonBlockingStream:
+    """Writes to a terminal without ever blocking. What the terminal can't take right
+    away waits in an outgoing buffer and goes out on the next writes, flushes and
+    drains, so a congested pty or SSH link fills the buffer instead of stalling the
+    writer.
+
+    Every flush ends a frame. A frame's write latency is how long it took from its
+    flush until its last byte was taken by the terminal, see stats."""
+    def __init__(self, fd: int = None, clock=time.perf_counter, history: int = 64):
+        fd = sys.stdout.fileno() if fd is None else fd
+        self.clock = clock
+        # A terminal gets opened again, so it's only this stream that doesn't block and not
+        # stdin, which shares the terminal's open file with stdout
+        self.owned = os.isatty(fd)
+        self.fd = os.open(os.ttyname(fd), os.O_WRONLY | os.O_NOCTTY) if self.owned else fd
+        self.was_blocking = os.get_blocking(self.fd)
+        os.set_blocking(self.fd, False)
+        self.outgoing = bytearray()
+        self.queued = 0 # Bytes ever written to the stream
+        self.sent = 0 # Bytes the terminal took
+        self.frames: deque = deque() # (bytes queued at its flush, time of its flush) of the frames not fully sent
+        self.latencies: deque = deque(maxlen=history) # Write latencies of the last frames, in seconds
+        self.max_latency = 0.0
+        self.frames_sent = 0 # Frames the terminal took all of
+
+    def fileno(self):
+        return self.fd
+
+    def isatty(self):
+        return os.isatty(self.fd)
+
+    @property
+    def pending(self):
+        # Bytes written to the stream that the terminal didn't take yet
+        return len(self.outgoing)
+
+    def write(self, data: str):
+        encoded = data.encode()
+        self.outgoing += encoded
+        self.queued += len(encoded)
+        return len(data)
+
+    def flush(self):
+        self.frames.append((self.queued, self.clock()))
+        self.drain()
+
+    def drain(self):
+        """Send as much of the outgoing buffer as the terminal takes right now.
+
+        Returns:
+            bool: Whether everything got sent."""
+        outgoing = self.outgoing
+        sent = 0
+        try:
+            while sent < len(outgoing):
+                sent += os.write(self.fd, memoryview(outgoing)[sent:])
+        except (BlockingIOError, InterruptedError):
+            pass
+        if sent:
+            del outgoing[:sent]
+            self.sent += sent
+            now = self.clock()
+            frames = self.frames
+            while frames and frames[0][0] <= self.sent:
+                latency = now - frames.popleft()[1]
+                self.frames_sent += 1
+                self.latencies.append(latency)
+                if latency > self.max_latency: self.max_latency = latency
+        return not outgoing
+
+    def wait(self, timeout: float):
+        """Wait for the terminal to take more of the outgoing buffer, and send it.
+
+        Args:
+            timeout (float): How long to wait at most, in seconds.
+
+        Returns:
+            bool: Whether everything got sent."""
+        if not self.outgoing: return True
+        select.select((), (self.fd,), (), timeout)
+        return self.drain()
+
+    def backlog_age(self):
+        # How long the oldest frame not fully sent has been waiting, in seconds.
+        # Safe to call from another thread than the writing one, like the rest of the stats
+        try:
+            return self.clock() - self.frames[0][1] if self.outgoing else 0.0
+        except IndexError: # Sent in the meantime
+            return 0.0
+
+    def stats(self):
+        """Get how the output is keeping up.
+
+        Returns:
+            Dict[str, float]: The pending bytes, bytes and frames sent, the last, average and max write latency
+                and how long the oldest frame not fully sent has been waiting, in milliseconds."""
+        latencies = tuple(self.latencies)
+        return {
+            'pending_bytes': self.pending,
+            'bytes_sent': self.sent,
+            'frames_sent': self.frames_sent,
+            'latency_last_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'latency_avg_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            'latency_max_ms': self.max_latency * 1000,
+            'backlog_age_ms': self.backlog_age() * 1000,
+        }
+
+    def close(self):
+        """Send whatever is left, blocking, and put the terminal back the way it was.
+
+        Returns:
+            None"""
+        os.set_blocking(self.fd, True)
+        while self.outgoing:
+            sent = os.write(self.fd, self.outgoing)
+            del self.outgoing[:sent]
+            self.sent += sent
+        if self.owned:
+            os.close(self.fd)
+        else:
+            os.set_blocking(self.fd, self.was_blocking)
+
+class FramePresenter:
+    """Keeps track of what is currently displayed on the terminal and only
+    writes the cells that changed since the last presented frame.
+
+    With detect_colors the framebuffers' color mode is detected from the terminal
+    right before the first framebuffer gets presented, rather than at startup.
+
+    On a stream that can fall behind (a NonBlockingStream) frames are skipped while
+    the terminal still hasn't taken the last one, the next frame presented gets
+    diffed against what was actually sent."""
+    def __init__(self, stream=None, detect_colors: bool = False):
+        # Where the frames get written to, defaults to the real terminal
+        self.stream = stream if stream is not None else sys.stdout
+        self.detect_colors = detect_colors
+        # Running totals, for benchmarks and diagnostics
+        self.frames_presented = 0
+        self.frames_skipped = 0 # Frames not written because the terminal was still busy with the last one
+        self.cells_written = 0
+        self.bytes_written = 0
+        # What the terminal is showing right now, keyed by cell position
+        self.displayed: dict = {}
+        # Same thing for framebuffers, as copies of the last presented arrays
+        self.displayed_glyphs: array = None
+        self.displayed_styles: array = None
+        # Called with every frame before it gets presented, to draw overlays like the profiler's HUD
+        self.overlay = None
+
+    def invalidate(self):
+        """Forget the displayed frame, to be called once the terminal got blanked.
+
+        Returns:
+            None"""
+        self.displayed.clear()
+        self.displayed_glyphs = None
+        self.displayed_styles = None
+
+    def backlogged(self):
+        # Whether the stream still holds bytes of the last frame after sending what it can
+        drain = getattr(self.stream, 'drain', None)
+        return drain is not None and not drain()
+
+    def stats(self):
+        """Get the presenter's totals, and how the stream is keeping up when it can tell.
+
+        Returns:
+            Dict[str, float]: The frames presented and skipped, cells and bytes written, and the stream's stats."""
+        stats = {
+            'frames_presented': self.frames_presented,
+            'frames_skipped': self.frames_skipped,
+            'cells_written': self.cells_written,
+            'bytes_written': self.bytes_written,
+        }
+        stream_stats = getattr(self.stream, 'stats', None)
+        if stream_stats is not None: stats.update(stream_stats())
+        return stats
+
+    def diff(self, sd: ScreenData):
+        """Get the cells of a frame that differ from what is displayed.
+
+        Args:
+            sd (ScreenData): The frame to compare against the displayed one.
+
+        Returns:
+            List[Tuple[Coords, str]]: The changed cells, in frame order."""
+        displayed = self.displayed
+        return [(key, value) for key, value in sd.items() if displayed.get(key) != value]
+
+    def present(self, sd: ScreenData):
+        """Write the changed cells of a frame in one go, with a single flush.
+
+        Args:
+            sd (ScreenData): The frame to present.
+
+        Returns:
+            int: The number of cells that were written."""
+        if self.backlogged():
+            self.frames_skipped += 1
+            return 0
+        if self.overlay is not None: self.overlay(sd)
+        if isinstance(sd, Framebuffer): return self.present_framebuffer(sd)
+
+        changes = self.diff(sd)
+        if not changes: return 0
+
+        buffer = []
+        for key, value in changes:
+            key: Coords; value: str
+            # +1 to account for 1-indexed cursor positions
+            buffer.append(f"\033[{key.ypos + 1};{key.xpos + 1}H")
+            buffer.append(value)
+            self.displayed[key] = value
+
+        self.write(''.join(buffer), len(changes))
+        return len(changes)
+
+    def present_framebuffer(self, fb: Framebuffer):
+        """Write the cells of a framebuffer that changed since the last one.
+
+        Args:
+            fb (Framebuffer): The frame to present.
+
+        Returns:
+            int: The number of cells that were written."""
+        if self.detect_colors:
+            # Sprites get sent in the shortest color encoding the terminal understands
+            Framebuffer.set_color_mode(terminal_caps.detect_color_mode(stream=self.stream))
+            self.detect_colors = False
+        if self.displayed_glyphs is None or len(self.displayed_glyphs) != fb.size:
+            # Nothing (or a different size of frame) is displayed, so compare against a blank screen
+            self.displayed_glyphs = array('I', fb.blank_glyphs)
+            self.displayed_styles = array('H', fb.blank_styles)
+
+        glyphs, styles = fb.glyphs, fb.styles
+        old_glyphs, old_styles = self.displayed_glyphs, self.displayed_styles
+        transition = self.transition
+        width = fb.width
+        buffer = []
+        written = 0
+        current_style = 0 # The terminal's style, escape sequences only get sent when it changes
+        cursor = -1 # Index of the cell the terminal's cursor is on, -1 when unknown
+
+        for ypos in range(fb.height):
+            start = ypos * width
+            end = start + width
+            # Whole rows that did not change get skipped with a single comparison
+            if glyphs[start:end] == old_glyphs[start:end] and styles[start:end] == old_styles[start:end]:
+                continue
+            for index in range(start, end):
+                glyph, style = glyphs[index], styles[index]
+                if glyph == old_glyphs[index] and style == old_styles[index]: continue
+                # Cells right after the last written one need no cursor move
+                if index != cursor:
+                    # +1 to account for 1-indexed cursor positions
+                    buffer.append(f"\033[{ypos + 1};{index - start + 1}H")
+                if style != current_style:
+                    buffer.append(transition(current_style, style))
+                    current_style = style
+                buffer.append(chr(glyph))
+                written += 1
+                # Past the last column the cursor stays put, so the next row needs a move
+                cursor = index + 1 if index + 1 < end else -1
+
+        if not written: return 0
+        # Leave the terminal in its default style for whatever writes after the frame
+        if current_style: buffer.append(Framebuffer.RESET)
+        old_glyphs[:] = glyphs
+        old_styles[:] = styles
+        self.write(''.join(buffer), written)
+        return written
+
+    @staticmethod
+    def transition(current: int, new: int):
+        """Get the escape sequence going from a palette style to another one, cached.
+
+        Args:
+            current (int): The palette index of the current style.
+            new (int): The palette index of the new style.
+
+        Returns:
+            str: The escape sequence."""
+        key = (current, new)
+        sequence = Framebuffer.transitions.get(key)
+        if sequence is None:
+            palette = Framebuffer.encoded_palette
+            sequence = Framebuffer.transitions[key] = palette[current].transition(palette[new])
+        return sequence
+
+    def write(self, data: str, cells: int):
+        """Write an encoded frame to the stream with a single flush.
+
+        Args:
+            data (str): The escape sequences and glyphs of the frame.
+            cells (int): How many cells the frame updates.
+
+        Returns:
+            None"""
+        self.stream.write(data)
+        self.stream.flush()
+        self.frames_presented += 1
+        self.cells_written += cells
+        self.bytes_written += len(data.encode())
+
+class PresenterThread:
+    """Presents frames from a background thread, so terminal writes overlap with the
+    simulation instead of stalling it.
+
+    The game loop composes each frame in its own screen and hands it over with submit(),
+    which copies it into the back buffer. The thread swaps the back buffer with its front
+    buffer and presents that, while the next frame gets composed. When a frame comes in
+    before the thread picked up the previous one, the previous one is stale and gets
+    dropped: only the newest frame ever gets presented.
+
+    On a stream that can fall behind, the thread waits for the terminal to take the
+    last frame before presenting the next one, the frames submitted meanwhile replace
+    each other, so a slow terminal gets fewer frames rather than a growing backlog."""
+    DRAIN_POLL = 0.05 # Longest wait for the terminal before checking whether the thread got stopped
+
+    def __init__(self, presenter: FramePresenter, timer=None):
+        self.presenter = presenter
+        self.timer = timer # Times the presents as the 'present' phase, when given
+        self.back: Framebuffer = None # The newest frame, waiting to be presented
+        self.front: Framebuffer = None # The frame being presented
+        self.waiting = False # Whether the back buffer holds a frame that was not presented yet
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread: threading.Thread = None
+        self.error: BaseException = None # What stopped the thread, raised again on the game loop's side
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='presenter', daemon=True)
+        self.thread.start()
+
+    def submit(self, fb: Framebuffer):
+        """Hand a composed frame over to be presented, it can be drawn on again right away.
+
+        Args:
+            fb (Framebuffer): The frame.
+
+        Returns:
+            None"""
+        if self.error is not None: raise self.error
+        with self.condition:
+            if self.back is None or self.back.size != fb.size:
+                self.back = Framebuffer(fb.width, fb.height)
+            if self.waiting: self.frames_dropped += 1 # The thread never got to it
+            self.back.copy_from(fb)
+            self.back.origin_x = fb.origin_x
+            self.waiting = True
+            self.frames_submitted += 1
+            self.condition.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.running and not self.waiting: self.condition.wait()
+                    if not self.waiting: return # Stopped, with every frame presented
+                while self.running and not self.drained(): pass
+                with self.condition:
+                    self.back, self.front = self.front, self.back
+                    self.waiting = False
+                if self.timer is None:
+                    self.presenter.present(self.front)
+                else:
+                    with self.timer.phase('present'):
+                        self.presenter.present(self.front)
+        except BaseException as error:
+            self.error = error
+
+    def drained(self):
+        # Wait a little for the terminal to take the rest of the last frame
+        wait = getattr(self.presenter.stream, 'wait', None)
+        return wait is None or wait(PresenterThread.DRAIN_POLL)
+
+    def stop(self):
+        """Present the frame still waiting, if any, and stop the thread.
+
+        Returns:
+            None"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None: self.thread.join()
+        self.thread = None
+
 class Terminal:
+    # Presenter used by update_screen, swap it out to write somewhere else
+    presenter = FramePresenter(detect_colors=True)
+
     @staticmethod
     def clear():
-        os.system('cls' if os.name == 'nt' else 'clear')
+        # Erase the screen and home the cursor, without spawning a process for it
+        sys.stdout.write("\033[2J\033[H")
+        sys.stdout.flush()
+        Terminal.presenter.invalidate() # The screen is blank now, nothing is displayed anymore
 
     @staticmethod
     def hide_cursor():
@@ -43,12 +817,45 @@ class Terminal:
 
     @staticmethod
     def update_screen(sd: ScreenData):
-        for key, value in sd.items():
-            key: Coords; value: str
-            Terminal.move_cursor(key.xpos + 1, key.ypos + 1)  # +1 to account for 1-indexed cursor positions
-            sys.stdout.write(value)
-            sys.stdout.flush()
+        # Only the cells that changed since the last frame get written
+        return Terminal.presenter.present(sd)
     
     @staticmethod
     def place_sprite(sd: ScreenData, sprite: str, pos: Coords): # Function created for readability
-        sd.update({pos: sprite}) # Place the sprite at the given position
\ No newline at end of file
+        sd[pos] = sprite # Place the sprite at the given position
+
+    @staticmethod
+    def place_sprite_run(sd: ScreenData, sprite: str, pos: Coords, count: int):
+        """Place the same sprite in a run of cells going right from pos.
+
+        Args:
+            sd (ScreenData): The screen to place the sprites on.
+            sprite (str): The sprite to place.
+            pos (Coords): The position of the first sprite.
+            count (int): How many sprites to place.
+
+        Returns:
+            None"""
+        # Framebuffers can do the whole run as one bulk fill
+        if isinstance(sd, Framebuffer):
+            sd.fill(pos, count, sprite)
+            return
+        for number in range(count):
+            sd[Coords(pos.xpos + number, pos.ypos)] = sprite
+
+    @staticmethod
+    def place_text(sd: ScreenData, text: str, pos: Coords):
+        """Place text at a fixed place of the screen, for HUD and debug lines
+        that must not scroll with the camera.
+
+        Args:
+            sd (ScreenData): The screen to place the text on.
+            text (str): The text to place.
+            pos (Coords): The screen position of the text.
+
+        Returns:
+            None"""
+        if isinstance(sd, Framebuffer):
+            sd.put_text(pos.xpos, pos.ypos, text)
+            return
+        sd[pos] = text
\ No newline at end of file
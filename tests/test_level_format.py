@@ -0,0 +1,131 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Engine
+from lib import level_format
+from lib.level_format import LevelFormatError
+from lib.terminal_graphics import Framebuffer
+
+LEVEL_TEXT = '\n'.join([
+    '                                        ',
+    '                                        ',
+    '  P                                     ',
+    '                                        ',
+    '          $  $        ?                 ',
+    '                                        ',
+    '                 B                      ',
+    '                                        ',
+    '                           M       M    ',
+    '#########################  #############',
+    '                                        ',
+    '                                        ',
+])
+
+def frames(level, ticks=40):
+    # The glyphs and styles of every frame of a short scripted run
+    world = Engine.build_world_from_level(Framebuffer(80, 12), level)
+    rendered = []
+    for tick in range(ticks):
+        world.apply_action('right')
+        if tick % 8 == 0: world.apply_action('jump')
+        try:
+            world.tick()
+        except Engine.Player.GameOverException:
+            break
+        screen = world.render()
+        rendered.append((bytes(screen.glyphs), bytes(screen.styles)))
+    return rendered
+
+@pytest.fixture
+def level_path(tmp_path):
+    path = tmp_path / 'level.tpel'
+    level_format.save_level(str(path), level_format.level_from_text(LEVEL_TEXT))
+    return path
+
+def test_text_round_trip():
+    level = level_format.level_from_text(LEVEL_TEXT)
+    assert level_format.level_to_text(level) == LEVEL_TEXT
+    assert level_format.same_level(level, level_format.level_from_text(level_format.level_to_text(level)))
+
+def test_file_round_trip(level_path):
+    assert level_format.same_level(level_format.level_from_text(LEVEL_TEXT), level_format.load_level(str(level_path)))
+
+def test_loaded_level_renders_the_same(level_path):
+    expected = frames(level_format.level_from_text(LEVEL_TEXT))
+    assert expected
+    assert frames(level_format.load_level(str(level_path))) == expected
+
+def test_world_round_trip(level_path):
+    world = Engine.build_world_from_level(Framebuffer(80, 12), level_format.load_level(str(level_path)))
+    assert level_format.same_level(Engine.world_to_level(world), level_format.level_from_text(LEVEL_TEXT))
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.tpel'
+    path.write_bytes(b'')
+    with pytest.raises(LevelFormatError):
+        level_format.load_level(str(path))
+
+def test_not_a_level_file(tmp_path):
+    path = tmp_path / 'text.tpel'
+    path.write_bytes(LEVEL_TEXT.encode())
+    with pytest.raises(LevelFormatError):
+        level_format.load_level(str(path))
+
+@pytest.mark.parametrize('cut', [1, level_format.HEADER.size + 1, level_format.ENTITY.size])
+def test_truncated_file(level_path, cut):
+    data = level_path.read_bytes()
+    level_path.write_bytes(data[:-cut])
+    with pytest.raises(LevelFormatError):
+        level_format.load_level(str(level_path))
+
+def test_trailing_data(level_path):
+    level_path.write_bytes(level_path.read_bytes() + b'\0')
+    with pytest.raises(LevelFormatError):
+        level_format.load_level(str(level_path))
+
+def test_wrong_version(level_path):
+    data = bytearray(level_path.read_bytes())
+    level_format.HEADER.pack_into(data, 0, level_format.MAGIC, level_format.VERSION + 1,
+                                  *level_format.HEADER.unpack_from(data)[2:])
+    level_path.write_bytes(bytes(data))
+    with pytest.raises(LevelFormatError, match='version'):
+        level_format.load_level(str(level_path))
+
+def test_unknown_entity_kind():
+    level = level_format.level_from_text(LEVEL_TEXT)
+    level.entities.append((99, 5, 5))
+    with pytest.raises(LevelFormatError):
+        Engine.build_world_from_level(Framebuffer(80, 12), level)
+
+CEILING_TEXT = '\n'.join([
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '   #####',
+    '',
+    '',
+    '     P',
+    '##########',
+    '',
+])
+
+def test_jumping_into_a_ceiling_tile():
+    world = Engine.build_world_from_level(Framebuffer(80, 12), level_format.level_from_text(CEILING_TEXT))
+    player = world.player
+    world.tick()
+    assert player.grounded
+    world.apply_action('jump')
+    heights = []
+    for _ in range(8):
+        world.tick()
+        heights.append(player.pos.ypos)
+    # The player bumps its head under the tile and falls back, it never gets on top of it
+    assert min(heights) == 7
+    assert heights[-1] == 9